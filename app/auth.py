@@ -1,29 +1,91 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
+from uuid import UUID
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.hash import argon2
-from sqlalchemy import select
+from sqlalchemy import event, inspect, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from .cache import TTLCache, get_redis
 from .config import settings
 from .database import get_session
 from .models import User
 
+logger = logging.getLogger(__name__)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 
-def hash_password(password: str) -> str:
-    return argon2.hash(password)
+class PasswordHasher:
+    """
+    Runs argon2 hashing and verification on a dedicated thread pool.
 
+    argon2 takes tens to hundreds of milliseconds of CPU per call and
+    releases the GIL while doing so, so running it off the event loop keeps
+    WebSockets and other requests on the worker responsive during login
+    bursts. At most max_pending calls may be queued or running; beyond that
+    callers get 503 instead of waiting indefinitely.
+    """
 
-def verify_password(password: str, hashed: str) -> bool:
-    try:
-        return argon2.verify(password, hashed)
-    except Exception:
-        return False
+    def __init__(self, workers: int, max_pending: int, time_cost: int, memory_cost: int, parallelism: int):
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._argon2 = argon2.using(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="argon2")
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent logins, try again",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self._argon2.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(self._verify, password, hashed)
+
+    def _verify(self, password: str, hashed: str) -> bool:
+        try:
+            return self._argon2.verify(password, hashed)
+        except Exception:
+            return False
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "rejected": self.rejected}
+
+
+password_hasher = PasswordHasher(
+    workers=settings.password_hash_workers,
+    max_pending=settings.password_hash_max_pending,
+    time_cost=settings.argon2_time_cost,
+    memory_cost=settings.argon2_memory_cost,
+    parallelism=settings.argon2_parallelism,
+)
+
+
+async def hash_password(password: str) -> str:
+    return await password_hasher.hash(password)
+
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await password_hasher.verify(password, hashed)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -33,21 +95,139 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, settings.jwt_secret, algorithm=settings.jwt_algorithm)
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)) -> User:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+class PrincipalCache:
+    """
+    Caches authenticated users by token subject so that authenticating a
+    request does not cost a database round trip.
+
+    Lookups go through a per-process LRU first and, when enabled, a shared
+    Redis tier second. Cached users are detached snapshots (id, username,
+    timezone, created_at) — read their attributes, never add them to a session.
+    Entries are dropped explicitly when a user is updated or deleted through
+    the ORM; other workers' local tiers converge within the TTL.
+    """
+
+    def __init__(self, maxsize: int, ttl: int, use_redis: bool):
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self._local = TTLCache(maxsize, ttl)
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _redis_key(username: str) -> str:
+        return f"{settings.app_name}:principal:{username}"
+
+    @staticmethod
+    def _snapshot(data: dict) -> User:
+        return User(
+            id=UUID(data["id"]),
+            username=data["username"],
+            # entries written before users had a time zone
+            timezone=data.get("timezone", settings.default_timezone),
+            created_at=datetime.fromisoformat(data["created_at"]),
+        )
+
+    async def get(self, username: str) -> Optional[User]:
+        user = self._local.get(username)
+        if user is not None:
+            self.hits += 1
+            return user
+        if self.use_redis:
+            try:
+                raw = await get_redis().get(self._redis_key(username))
+            except Exception:
+                logger.warning("Principal cache: Redis unavailable", exc_info=True)
+                raw = None
+            if raw is not None:
+                self.redis_hits += 1
+                user = self._snapshot(json.loads(raw))
+                self._local.set(username, user)
+                return user
+        self.misses += 1
+        return None
+
+    async def set(self, user: User) -> None:
+        data = {"id": str(user.id), "username": user.username, "timezone": user.timezone, "created_at": user.created_at.isoformat()}
+        self._local.set(user.username, self._snapshot(data))
+        if self.use_redis:
+            try:
+                await get_redis().set(self._redis_key(user.username), json.dumps(data), ex=self.ttl)
+            except Exception:
+                logger.warning("Principal cache: Redis unavailable", exc_info=True)
+
+    async def invalidate(self, username: str) -> None:
+        self._local.pop(username)
+        if self.use_redis:
+            try:
+                await get_redis().delete(self._redis_key(username))
+            except Exception:
+                logger.warning("Principal cache: Redis unavailable", exc_info=True)
+
+    def discard(self, username: str) -> None:
+        """Synchronous invalidate for ORM event hooks; the Redis delete runs as a task."""
+        self._local.pop(username)
+        if self.use_redis:
+            try:
+                asyncio.get_running_loop().create_task(self.invalidate(username))
+            except RuntimeError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "size": len(self._local),
+        }
+
+
+principal_cache = PrincipalCache(
+    maxsize=settings.auth_cache_max_entries,
+    ttl=settings.auth_cache_ttl_seconds,
+    use_redis=settings.auth_cache_redis,
+)
+
+
+@event.listens_for(User, "after_update")
+def _invalidate_updated_user(mapper, connection, target):
+    # covers password changes and renames (the old username is in the history)
+    history = inspect(target).attrs.username.history
+    for username in {target.username, *(history.deleted or ())}:
+        principal_cache.discard(username)
+
+
+@event.listens_for(User, "after_delete")
+def _invalidate_deleted_user(mapper, connection, target):
+    principal_cache.discard(target.username)
+
+
+async def authenticate_token(token: str, session: AsyncSession) -> Optional[User]:
+    """Resolve a bearer token to its user, or None if the token or user is invalid."""
     try:
         payload = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
-        username: str | None = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        return None
+    username: str | None = payload.get("sub")
+    if username is None:
+        return None
+    user = await principal_cache.get(username)
+    if user is not None:
+        return user
     result = await session.execute(select(User).where(User.username == username))
     user = result.scalar_one_or_none()
+    if user is not None:
+        await principal_cache.set(user)
+    return user
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)) -> User:
+    user = await authenticate_token(token, session)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
@@ -0,0 +1,332 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import ot
+from .config import settings
+from .database import AsyncSessionLocal
+from .models import Note, utcnow
+from .realtime import broadcaster, note_channel
+from .serialization import dumps_text
+from .sync import NOTE, bump_version
+
+logger = logging.getLogger(__name__)
+
+
+class StaleRevision(Exception):
+    """The client's base revision is no longer in the retained history."""
+
+
+def note_state_message(kind: str, note, **extra) -> str:
+    """Full-state note message; note is a Note or a NoteDocument."""
+    return dumps_text(
+        {
+            "type": kind,
+            "id": note.id,
+            "title": note.title,
+            "content": note.content,
+            "rev": note.revision,
+            "updated_at": note.updated_at,
+            **extra,
+        }
+    )
+
+
+def note_patch_message(doc: "NoteDocument", ops: list, origin: Optional[str]) -> str:
+    """The operation that produced doc's current revision; origin is the sender's session, None for merges."""
+    return dumps_text(
+        {
+            "type": "note_patch",
+            "id": doc.id,
+            "rev": doc.revision,
+            "ops": ops,
+            "title": doc.title,
+            "updated_at": doc.updated_at,
+            "origin": origin,
+        }
+    )
+
+
+class NoteDocument:
+    """
+    Live, in-memory state of a note being edited over WebSockets.
+
+    Every accepted operation produces a new revision. The last few
+    operations are kept so that an edit made against an older revision can
+    be rebased (transformed) onto the current text instead of overwriting
+    it. Revisions above persisted_revision exist only in memory until the
+    registry flushes them; persisted_title and persisted_content are the
+    stored note as of persisted_revision, the base for merging writes made
+    elsewhere (see merge()). Callers serialize changes through lock.
+    """
+
+    def __init__(self, note: Note, history_size: int):
+        self.id: UUID = note.id
+        # (base revision, revision, operation); merged writes may skip revisions
+        self.history: deque[tuple[int, int, list]] = deque(maxlen=history_size)
+        self.lock = asyncio.Lock()
+        self.flush_task: Optional[asyncio.Task] = None
+        self.reset(note)
+
+    def reset(self, note: Note) -> None:
+        self.title = note.title
+        self.content = note.content
+        self.revision = note.revision
+        self.updated_at = note.updated_at
+        self.saved(note.updated_at)
+        self.history.clear()
+
+    def saved(self, updated_at) -> None:
+        """Record that the current state is the stored one."""
+        self.updated_at = updated_at
+        self.persisted_revision = self.revision
+        self.persisted_title = self.title
+        self.persisted_content = self.content
+
+    @property
+    def dirty(self) -> bool:
+        return self.revision != self.persisted_revision
+
+    def apply(self, base_revision: int, ops: list) -> list:
+        """Apply ops made against base_revision; returns them rebased onto the new revision."""
+        oldest = self.history[0][0] if self.history else self.revision
+        if base_revision > self.revision or base_revision < oldest:
+            raise StaleRevision(base_revision)
+        for _, revision, concurrent in self.history:
+            if revision > base_revision:
+                ops, _ = ot.transform(ops, concurrent)
+        self.content = ot.apply(self.content, ops)
+        self.history.append((self.revision, self.revision + 1, ops))
+        self.revision += 1
+        self.updated_at = utcnow()
+        return ops
+
+    def replace(self, content: str) -> list:
+        """Overwrite the whole text (REST PATCH, legacy update message) as one revision."""
+        return self.apply(self.revision, ot.replace(self.content, content))
+
+    def merge(self, note: Note) -> Optional[list]:
+        """
+        Fold in a write made elsewhere (another worker's document, a REST
+        request there): the stored note's change since persisted_revision is
+        rebased over the unwritten local edits and applied as one revision,
+        which is returned; None if the stored note is the one we know.
+
+        Unwritten edits stay unwritten, now on top of the stored note. A clean
+        document takes the stored revision; a dirty one moves past it, so its
+        next write still raises the stored revision.
+        """
+        if note.revision == self.persisted_revision:
+            return None
+        dirty = self.dirty
+        ours = ot.replace(self.persisted_content, self.content)
+        _, theirs = ot.transform(ours, ot.replace(self.persisted_content, note.content))
+        if self.title == self.persisted_title:
+            self.title = note.title
+        self.content = ot.apply(self.content, theirs)
+        base = self.revision
+        self.revision = max(self.revision, note.revision) + 1 if dirty else max(self.revision + 1, note.revision)
+        self.history.append((base, self.revision, theirs))
+        self.updated_at = max(self.updated_at, note.updated_at)
+        self.persisted_revision = note.revision
+        self.persisted_title = note.title
+        self.persisted_content = note.content
+        return theirs
+
+    async def persist(self, session: AsyncSession) -> bool:
+        """
+        Write the current state if the stored revision is still the one we last saw.
+        False means the row changed underneath us (another worker) or is gone.
+
+        updated_at is the time of the write, not of the last edit: GET /sync
+        tokens issued while the edit was waiting to be flushed must still
+        see it as a change.
+        """
+        updated_at = utcnow()
+        result = await session.execute(
+            update(Note)
+            .where((Note.id == self.id) & (Note.revision == self.persisted_revision))
+            .values(title=self.title, content=self.content, revision=self.revision, updated_at=updated_at)
+            .returning(Note.owner_id)
+        )
+        owner_id = result.scalar_one_or_none()
+        if owner_id is None:
+            await session.rollback()
+            return False
+        await bump_version(session, NOTE, owner_id)
+        await session.commit()
+        self.saved(updated_at)
+        return True
+
+
+class DocumentRegistry:
+    """
+    NoteDocuments for the notes that have open editors in this process, and
+    their write-behind to the database.
+
+    Edits are applied and sent to this process's editors immediately but
+    written at most once per flush_interval per note, or as soon as
+    flush_max_revisions unwritten revisions pile up. Documents are also
+    flushed when an editor disconnects and on application shutdown; a
+    document whose flush fails stays registered and is retried. Durability:
+    an acknowledged edit can be lost only if the process dies without
+    running shutdown (e.g. SIGKILL, power loss), and then at most
+    flush_interval seconds' worth.
+
+    Several workers may hold a document for the same note, each with its own
+    editors and revision numbers. They meet in the database: every write is
+    announced on STORED_CHANNEL, and a worker whose document falls behind
+    the stored note, or whose write loses the revision compare-and-set,
+    merges the stored note into its document (NoteDocument.merge) and sends
+    the merged change to its editors as a note_patch. Editors on different
+    workers therefore see each other's edits about one flush_interval late,
+    and no edit is dropped.
+    """
+
+    STORED_CHANNEL = "notes:stored"
+
+    def __init__(self, history_size: int, flush_interval: float, flush_max_revisions: int):
+        self.history_size = history_size
+        self.flush_interval = flush_interval
+        self.flush_max_revisions = flush_max_revisions
+        self._documents: dict[UUID, NoteDocument] = {}
+        self._refs: dict[UUID, int] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.flushes = 0
+        self.flush_failures = 0
+        self.merges = 0
+
+    async def start(self) -> None:
+        await broadcaster.listen(self.STORED_CHANNEL, self._stored)
+
+    def open(self, note: Note) -> NoteDocument:
+        doc = self._documents.get(note.id)
+        if doc is None:
+            doc = self._documents[note.id] = NoteDocument(note, self.history_size)
+        self._refs[note.id] = self._refs.get(note.id, 0) + 1
+        return doc
+
+    async def close(self, note_id: UUID) -> None:
+        refs = self._refs.get(note_id, 0) - 1
+        if refs > 0:
+            self._refs[note_id] = refs
+        else:
+            self._refs.pop(note_id, None)
+        doc = self._documents.get(note_id)
+        if doc is not None:
+            # shielded: a cancelled socket handler must not abort the write
+            await asyncio.shield(self.flush(doc))
+
+    def get(self, note_id: UUID) -> Optional[NoteDocument]:
+        return self._documents.get(note_id)
+
+    async def stored(self, note_id: UUID, revision: int) -> None:
+        """Announce a committed write of a note to every worker's documents."""
+        await broadcaster.publish(self.STORED_CHANNEL, dumps_text({"id": note_id, "revision": revision}))
+
+    def sync(self, doc: NoteDocument, note: Note) -> None:
+        """Merge the stored note into doc and send the change to its editors; call with doc.lock held."""
+        ops = doc.merge(note)
+        if ops is not None:
+            self.merges += 1
+            broadcaster.deliver(note_channel(doc.id), note_patch_message(doc, ops, None))
+
+    async def changed(self, doc: NoteDocument) -> bool:
+        """
+        Schedule or perform the write of a change; call with doc.lock held.
+        False means the note has been deleted meanwhile.
+        """
+        if doc.revision - doc.persisted_revision >= self.flush_max_revisions:
+            return await self._flush(doc)
+        if doc.flush_task is None:
+            doc.flush_task = asyncio.create_task(self._flush_later(doc))
+        return True
+
+    async def flush(self, doc: NoteDocument) -> None:
+        async with doc.lock:
+            await self._flush(doc)
+
+    async def flush_all(self) -> None:
+        for doc in list(self._documents.values()):
+            await self.flush(doc)
+
+    async def _flush_later(self, doc: NoteDocument) -> None:
+        await asyncio.sleep(self.flush_interval)
+        doc.flush_task = None
+        await self.flush(doc)
+
+    async def _flush(self, doc: NoteDocument) -> bool:
+        if doc.flush_task is not None and doc.flush_task is not asyncio.current_task():
+            doc.flush_task.cancel()
+            doc.flush_task = None
+        kept = True
+        if doc.dirty:
+            try:
+                async with AsyncSessionLocal() as session:
+                    kept = await self._write(session, doc)
+            except Exception:
+                self.flush_failures += 1
+                logger.exception("Flushing note %s failed, retrying", doc.id)
+                doc.flush_task = asyncio.create_task(self._flush_later(doc))
+                return True
+        if doc.id not in self._refs:
+            self._documents.pop(doc.id, None)
+        return kept
+
+    async def _write(self, session: AsyncSession, doc: NoteDocument) -> bool:
+        """Persist doc, merging the stored note and retrying whenever the compare-and-set loses."""
+        while not await doc.persist(session):
+            note = await session.get(Note, doc.id, populate_existing=True)
+            if note is None:
+                # deleted meanwhile; nothing left to write
+                doc.persisted_revision = doc.revision
+                return False
+            self.sync(doc, note)
+            if not doc.dirty:
+                return True
+        self.flushes += 1
+        await self.stored(doc.id, doc.revision)
+        return True
+
+    def _stored(self, message: str) -> None:
+        announced = json.loads(message)
+        doc = self._documents.get(UUID(announced["id"]))
+        if doc is not None and doc.persisted_revision != announced["revision"]:
+            task = asyncio.create_task(self._refresh(doc))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, doc: NoteDocument) -> None:
+        """Catch doc up with a write announced by another worker or request."""
+        try:
+            async with doc.lock:
+                async with AsyncSessionLocal() as session:
+                    note = await session.get(Note, doc.id)
+                if note is not None:
+                    self.sync(doc, note)
+                    if doc.dirty:
+                        await self.changed(doc)
+        except Exception:
+            logger.exception("Refreshing note %s failed", doc.id)
+
+    def stats(self) -> dict:
+        return {
+            "open": len(self._documents),
+            "dirty": sum(1 for doc in self._documents.values() if doc.dirty),
+            "flushes": self.flushes,
+            "flush_failures": self.flush_failures,
+            "merges": self.merges,
+        }
+
+
+documents = DocumentRegistry(
+    history_size=settings.note_history_size,
+    flush_interval=settings.note_flush_interval_seconds,
+    flush_max_revisions=settings.note_flush_max_revisions,
+)
@@ -1,14 +1,36 @@
 import asyncio
+from sqlalchemy import inspect, text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateColumn
 
 from .config import settings
 
-engine = create_async_engine(settings.database_url, echo=False, future=True)
+
+def _create_engine(url: str):
+    return create_async_engine(
+        url,
+        echo=False,
+        future=True,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout_seconds,
+        pool_recycle=settings.db_pool_recycle_seconds,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        connect_args={"prepared_statement_cache_size": settings.db_statement_cache_size},
+    )
+
+
+engine = _create_engine(settings.database_url)
+# reads that tolerate replication lag; the primary when no replica is configured
+read_engine = _create_engine(settings.database_read_url) if settings.database_read_url else engine
 
 AsyncSessionLocal = sessionmaker(
     bind=engine, class_=AsyncSession, expire_on_commit=False, autoflush=False, autocommit=False
 )
+ReadSessionLocal = sessionmaker(
+    bind=read_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False, autocommit=False
+)
 
 
 async def get_session() -> AsyncSession:
@@ -16,9 +38,31 @@ async def get_session() -> AsyncSession:
         yield session
 
 
+async def get_read_session() -> AsyncSession:
+    """Session for read-only routes; may lag the primary by the replica's replication delay."""
+    async with ReadSessionLocal() as session:
+        yield session
+
+
+def _create_all(conn, metadata):
+    metadata.create_all(conn)
+    # create_all leaves existing tables alone; add columns introduced since
+    inspector = inspect(conn)
+    for table in metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+    # create_all skips indexes of tables that already exist; add new ones
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
 async def init_models(metadata):
     async with engine.begin() as conn:
-        await conn.run_sync(metadata.create_all)
+        await conn.run_sync(_create_all, metadata)
 
 
 def run_sync(coro):
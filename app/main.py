@@ -1,64 +1,165 @@
 import asyncio
 import json
-from collections import defaultdict
-from datetime import datetime, timedelta
+import logging
+import secrets
+from contextlib import AsyncExitStack, nullcontext
+from datetime import datetime, timedelta, timezone
 from uuid import UUID
 
-from fastapi import Depends, FastAPI, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy import select
+from sqlalchemy import func, select
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .auth import create_access_token, get_current_user, hash_password, verify_password
+from . import ot
+from .auth import (
+    authenticate_token,
+    create_access_token,
+    get_current_user,
+    hash_password,
+    password_hasher,
+    principal_cache,
+    verify_password,
+)
+from .cache import etag_matches
+from .collab import NoteDocument, StaleRevision, documents, note_patch_message, note_state_message
 from .config import settings
-from .database import get_session, init_models
+from .database import AsyncSessionLocal, ReadSessionLocal, engine, get_read_session, get_session, init_models, read_engine
+from .metrics import CONTENT_TYPE, Gauge, MetricsMiddleware, instrument_engine, registry, watch_event_loop
 from .models import Base, CalendarEvent, Note, User
+from .pagination import NEXT_CURSOR_HEADER, fetch_page, parse_fields
+from .releases import ReleaseFileResponse, download_limiter, etag_for, parse_version, release_index
+from .realtime import broadcaster, calendar_channel, note_channel
+from .reminders import reminder_scheduler, schedule_reminders
+from .sync import EVENT, NOTE, bump_version, changes_since, collection_version, prune_tombstones_periodically, record_deletion
+from .serialization import FastJSONResponse, dumps_text, event_dict, note_dict
 from .schemas import (
+    CalendarEventBatchRequest,
+    CalendarEventBatchResult,
     CalendarEventCreate,
     CalendarEventOut,
     CalendarEventUpdate,
+    NoteBatchRequest,
+    NoteBatchResult,
     NoteCreate,
     NoteOut,
     NoteUpdate,
+    SyncOut,
     Token,
     UserCreate,
     UserOut,
+    UserUpdate,
 )
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI(title="Notes and Calendar API", version="0.1.0")
 
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[origin.strip() for origin in settings.cors_origins.split(",")],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
+)
+
+
+# component stats reported by /health and exported as gauges by /metrics
+COMPONENT_STATS = {
+    "auth_cache": principal_cache.stats,
+    "password_hasher": password_hasher.stats,
+    "broadcast": broadcaster.stats,
+    "documents": documents.stats,
+    "reminders": reminder_scheduler.stats,
+    "releases": release_index.stats,
+    "downloads": download_limiter.stats,
+}
+# stats() keys that only ever grow, exported as counters
+COMPONENT_COUNTERS = {
+    "auth_cache": ("hits", "redis_hits", "misses"),
+    "password_hasher": ("rejected",),
+    "broadcast": ("sent", "dropped", "evicted", "reaped", "send_seconds_total"),
+    "documents": ("flushes", "flush_failures", "merges"),
+    "reminders": ("sent", "expired"),
+    "releases": ("scans",),
+    "downloads": ("rejected", "bytes_sent"),
+}
+for name, stats in COMPONENT_STATS.items():
+    registry.stats(name, stats, COMPONENT_COUNTERS.get(name, ()))
+registry.register(
+    Gauge(
+        "ws_channels",
+        "Open broadcast channels by kind",
+        lambda: {kind: channels for kind, (channels, _) in broadcaster.channel_counts().items()},
+        ("kind",),
+    )
+)
+registry.register(
+    Gauge(
+        "ws_subscriptions",
+        "WebSocket channel subscriptions by kind",
+        lambda: {kind: subscriptions for kind, (_, subscriptions) in broadcaster.channel_counts().items()},
+        ("kind",),
+    )
 )
+instrument_engine(engine, "primary")
+if read_engine is not engine:
+    instrument_engine(read_engine, "replica")
+background_tasks: set[asyncio.Task] = set()
 
 
 @app.on_event("startup")
 async def on_startup():
     await init_models(Base.metadata)
+    await broadcaster.start()
+    await documents.start()
+    await reminder_scheduler.start()
+    release_index.refresh(force=True)
+    background_tasks.add(asyncio.create_task(watch_event_loop()))
+    background_tasks.add(asyncio.create_task(prune_tombstones_periodically()))
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    for task in background_tasks:
+        task.cancel()
+    await documents.flush_all()
+    await reminder_scheduler.stop()
+    await broadcaster.stop()
 
 
 @app.get("/health")
 async def health():
-    return {"status": "ok", "ts": datetime.utcnow().isoformat()}
+    return {
+        "status": "ok",
+        "ts": datetime.utcnow().isoformat(),
+        **{name: stats() for name, stats in COMPONENT_STATS.items()},
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(registry.render(), media_type=CONTENT_TYPE)
 
 
 @app.post("/auth/register", response_model=UserOut, status_code=201)
 async def register(payload: UserCreate, session: AsyncSession = Depends(get_session)):
-    user = User(username=payload.username, hashed_password=hash_password(payload.password))
+    user = User(
+        username=payload.username,
+        hashed_password=await hash_password(payload.password),
+        timezone=payload.timezone or settings.default_timezone,
+    )
     session.add(user)
     try:
         await session.commit()
     except IntegrityError:
         await session.rollback()
         raise HTTPException(status_code=409, detail="Username already exists")
-    await session.refresh(user)
     return user
 
 
@@ -66,75 +167,331 @@ async def register(payload: UserCreate, session: AsyncSession = Depends(get_sess
 async def login(form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_session)):
     result = await session.execute(select(User).where(User.username == form_data.username))
     user = result.scalar_one_or_none()
-    if user is None or not verify_password(form_data.password, user.hashed_password):
+    if user is None or not await verify_password(form_data.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     expires_in = settings.access_token_exp_minutes * 60
     token = create_access_token({"sub": user.username}, expires_delta=timedelta(seconds=expires_in))
     return Token(access_token=token, expires_in=expires_in)
 
 
-# Notes REST
-@app.get("/notes", response_model=list[NoteOut])
-async def list_notes(current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
-    result = await session.execute(
-        select(Note)
-        .where((Note.owner_id == current_user.id) & (Note.archived == False))
-        .order_by(Note.updated_at.desc())
-    )
-    return result.scalars().all()
+@app.get("/auth/me", response_model=UserOut)
+async def read_me(current_user: User = Depends(get_current_user)):
+    return current_user
 
 
-@app.get("/notes/archived", response_model=list[NoteOut])
-async def list_archived_notes(current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+@app.patch("/auth/me", response_model=UserOut)
+async def update_me(payload: UserUpdate, current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    """Change the user's time zone; pending reminders of their events move with it."""
+    user = await session.get(User, current_user.id)
+    user.timezone = payload.timezone
     result = await session.execute(
-        select(Note)
-        .where((Note.owner_id == current_user.id) & (Note.archived == True))
-        .order_by(Note.updated_at.desc())
+        select(CalendarEvent).where((CalendarEvent.owner_id == user.id) & (CalendarEvent.reminder_minutes != ""))
     )
-    return result.scalars().all()
+    fire_times = await schedule_reminders(session, list(result.scalars()), {user.id: user.timezone}, force=True)
+    await session.commit()
+    await reminder_scheduler.notify(fire_times)
+    return user
 
 
-@app.post("/notes", response_model=NoteOut, status_code=201)
-async def create_note(payload: NoteCreate, current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
-    note = Note(
+# Notes REST
+def new_note(payload: NoteCreate, owner_id: UUID) -> Note:
+    return Note(
         title=payload.title,
         content=payload.content,
         color=payload.color,
         tags=payload.tags or "",
-        owner_id=current_user.id
+        owner_id=owner_id
+    )
+
+
+def apply_note_update(note: Note, payload: NoteUpdate, doc: NoteDocument | None) -> None:
+    """
+    Copy the set fields of payload onto note; with a live doc, call with doc.lock held.
+
+    A title or content change bumps the revision, which live documents on
+    other workers compare before writing, so they merge it instead of
+    overwriting it.
+    """
+    title_changed = payload.title is not None and payload.title != (doc or note).title
+    if doc is not None:
+        # write through the document, including its not yet flushed edits
+        if payload.title is not None:
+            doc.title = payload.title
+        if payload.content is not None:
+            doc.replace(payload.content)
+        elif title_changed:
+            doc.replace(doc.content)  # an empty edit, for the revision
+        note.title, note.content, note.revision = doc.title, doc.content, doc.revision
+    else:
+        content_changed = payload.content is not None and payload.content != note.content
+        if payload.title is not None:
+            note.title = payload.title
+        if content_changed:
+            note.content = payload.content
+        if title_changed or content_changed:
+            note.revision += 1
+    if payload.color is not None:
+        note.color = payload.color
+    if payload.tags is not None:
+        note.tags = payload.tags
+    if payload.archived is not None:
+        note.archived = payload.archived
+
+
+# clients may keep responses but must revalidate them; unchanged ones cost a 304
+REVALIDATE = "private, no-cache"
+
+
+async def collection_etag(session: AsyncSession, collection: str, owner_id: UUID, request: Request) -> str:
+    """
+    ETag of a list response: the owner's collection version plus the URL,
+    as path and query (filters, cursor, fields) select the representation.
+    """
+    version = await collection_version(session, collection, owner_id)
+    return etag_for(f"{owner_id}:{collection}:{version}:{request.url.path}?{request.url.query}".encode())
+
+
+def not_modified(etag: str, if_none_match: str | None) -> Response | None:
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": REVALIDATE})
+    return None
+
+
+def page_response(rows: list, next_cursor: str | None, fields: list[str] | None, to_dict, etag: str) -> Response:
+    """
+    Lists are encoded from the rows directly (see app.serialization);
+    response_model only documents them. Projected rows are dicts already.
+    """
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    content = rows if fields is not None else [to_dict(row) for row in rows]
+    return FastJSONResponse(content, headers=headers)
+
+
+@app.get("/notes", response_model=list[NoteOut])
+async def list_notes(
+    request: Request,
+    limit: int | None = Query(None, ge=1, le=500),
+    cursor: str | None = None,
+    fields: str | None = None,
+    if_none_match: str | None = Header(None),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session),
+):
+    projection = parse_fields(fields, list(NoteOut.model_fields))
+    etag = await collection_etag(session, NOTE, current_user.id, request)
+    if (cached := not_modified(etag, if_none_match)) is not None:
+        return cached
+    rows, next_cursor = await fetch_page(
+        session,
+        Note,
+        (Note.owner_id == current_user.id) & (Note.archived == False),
+        Note.updated_at,
+        fields=projection,
+        limit=limit,
+        cursor=cursor,
+    )
+    return page_response(rows, next_cursor, projection, note_dict, etag)
+
+
+@app.get("/notes/archived", response_model=list[NoteOut])
+async def list_archived_notes(
+    request: Request,
+    limit: int | None = Query(None, ge=1, le=500),
+    cursor: str | None = None,
+    fields: str | None = None,
+    if_none_match: str | None = Header(None),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session),
+):
+    projection = parse_fields(fields, list(NoteOut.model_fields))
+    etag = await collection_etag(session, NOTE, current_user.id, request)
+    if (cached := not_modified(etag, if_none_match)) is not None:
+        return cached
+    rows, next_cursor = await fetch_page(
+        session,
+        Note,
+        (Note.owner_id == current_user.id) & (Note.archived == True),
+        Note.updated_at,
+        fields=projection,
+        limit=limit,
+        cursor=cursor,
     )
+    return page_response(rows, next_cursor, projection, note_dict, etag)
+
+
+@app.post("/notes", response_model=NoteOut, status_code=201)
+async def create_note(payload: NoteCreate, current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    note = new_note(payload, current_user.id)
     session.add(note)
+    await bump_version(session, NOTE, current_user.id)
     await session.commit()
-    await session.refresh(note)
     return note
 
 
+@app.post("/notes/batch", response_model=list[NoteBatchResult])
+async def batch_notes(
+    payload: NoteBatchRequest, current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)
+):
+    """
+    Apply create/update/delete operations in order, in one transaction.
+
+    Referenced notes are loaded with a single query and written in one
+    flush; unknown ids yield a 404 item without failing the batch. Each
+    affected note gets one broadcast with its final state.
+
+    Notes with a live document are written through it, under its lock. A
+    document opened while the batch waited for those locks does not take
+    part; it gets the batch's write merged in afterwards, like a write from
+    another worker.
+    """
+    ids = {op.id for op in payload.ops if op.op != "create"}
+    existing: dict[UUID, Note] = {}
+    if ids:
+        # locked (in id order, against deadlocks) as in update_note
+        result = await session.execute(
+            select(Note).where(Note.id.in_(ids) & (Note.owner_id == current_user.id)).order_by(Note.id).with_for_update()
+        )
+        existing = {note.id: note for note in result.scalars()}
+    live = {doc.id: doc for doc in filter(None, (documents.get(note_id) for note_id in existing))}
+
+    async with AsyncExitStack() as stack:
+        for doc in sorted(live.values(), key=lambda doc: str(doc.id)):
+            await stack.enter_async_context(doc.lock)
+            documents.sync(doc, existing[doc.id])
+        items: list[tuple[int, int, UUID | None, Note | None]] = []
+        updated: dict[UUID, Note] = {}
+        deleted: list[UUID] = []
+        for index, op in enumerate(payload.ops):
+            if op.op == "create":
+                note = new_note(op.data, current_user.id)
+                session.add(note)
+                items.append((index, 201, None, note))
+                continue
+            note = existing.get(op.id)
+            if note is None:
+                items.append((index, 404, op.id, None))
+            elif op.op == "update":
+                apply_note_update(note, op.data, live.get(note.id))
+                updated[note.id] = note
+                items.append((index, 200, note.id, note))
+            else:
+                await session.delete(note)
+                record_deletion(session, NOTE, note.id, current_user.id)
+                del existing[note.id]
+                updated.pop(note.id, None)
+                deleted.append(note.id)
+                items.append((index, 204, note.id, None))
+        await bump_version(session, NOTE, current_user.id)
+        await session.commit()
+        late = [note for note in updated.values() if documents.get(note.id) not in (None, live.get(note.id))]
+        for note in updated.values():
+            if note.id in live:
+                live[note.id].saved(note.updated_at)
+            if note not in late:
+                await broadcast_note_change(note)
+        for note_id in deleted:
+            await broadcast_note_delete(note_id)
+
+    # outside the batch's locks: these documents are locked one at a time
+    for note in late:
+        if (doc := documents.get(note.id)) is not None:
+            async with doc.lock:
+                documents.sync(doc, note)
+        await documents.stored(note.id, note.revision)
+
+    results = []
+    for index, code, note_id, note in items:
+        if code == 404:
+            results.append(NoteBatchResult(index=index, status=code, id=note_id, error="Note not found"))
+        elif note is not None:
+            results.append(NoteBatchResult(index=index, status=code, id=note.id, note=NoteOut.model_validate(note)))
+        else:
+            results.append(NoteBatchResult(index=index, status=code, id=note_id))
+    return results
+
+
+@app.get("/notes/search", response_model=list[NoteOut])
+async def search_notes(
+    q: str | None = None,
+    tags: str | None = None,
+    archived: bool | None = None,
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    fields: str | None = None,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session),
+):
+    """
+    Full-text search over title and content (websearch syntax: words,
+    "phrases", -excluded) and/or notes carrying all of the comma-separated
+    tags. Text matches are ordered by relevance, tag-only searches by
+    recency.
+    """
+    projection = parse_fields(fields, list(NoteOut.model_fields))
+    wanted = [tag.strip().lower() for tag in (tags or "").split(",") if tag.strip()]
+    if not (q and q.strip()) and not wanted:
+        raise HTTPException(status_code=400, detail="Provide q and/or tags")
+
+    columns = [getattr(Note, f) for f in projection] if projection is not None else [Note]
+    stmt = select(*columns).where(Note.owner_id == current_user.id)
+    if archived is not None:
+        stmt = stmt.where(Note.archived == archived)
+    if wanted:
+        stmt = stmt.where(Note.tag_list.contains(wanted))
+    if q and q.strip():
+        query = func.websearch_to_tsquery("simple", q)
+        stmt = stmt.where(Note.search_vector.op("@@")(query)).order_by(func.ts_rank(Note.search_vector, query).desc())
+    stmt = stmt.order_by(Note.updated_at.desc(), Note.id.desc()).limit(limit).offset(offset)
+
+    result = await session.execute(stmt)
+    if projection is None:
+        return FastJSONResponse([note_dict(note) for note in result.scalars()])
+    return FastJSONResponse([row._asdict() for row in result.all()])
+
+
 @app.get("/notes/{note_id}", response_model=NoteOut)
-async def get_note(note_id: UUID, current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+async def get_note(
+    note_id: UUID,
+    response: Response,
+    if_none_match: str | None = Header(None),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session),
+):
     note = await session.get(Note, note_id)
     if not note or note.owner_id != current_user.id:
         raise HTTPException(status_code=404, detail="Note not found")
+    doc = documents.get(note.id)
+    # live edits may not be flushed yet
+    current = doc if doc is not None else note
+    etag = etag_for(f"{note.id}:{current.revision}:{current.updated_at.isoformat()}".encode())
+    if (cached := not_modified(etag, if_none_match)) is not None:
+        return cached
+    response.headers.update({"ETag": etag, "Cache-Control": REVALIDATE})
+    if doc is not None:
+        live = {"title": doc.title, "content": doc.content, "revision": doc.revision, "updated_at": doc.updated_at}
+        return NoteOut.model_validate(note).model_copy(update=live)
     return note
 
 
 @app.patch("/notes/{note_id}", response_model=NoteOut)
 async def update_note(note_id: UUID, payload: NoteUpdate, current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
-    note = await session.get(Note, note_id)
+    # locked, so no live document's flush can slip in between this read and our write
+    note = await session.get(Note, note_id, with_for_update=True)
     if not note or note.owner_id != current_user.id:
         raise HTTPException(status_code=404, detail="Note not found")
-    if payload.title is not None:
-        note.title = payload.title
-    if payload.content is not None:
-        note.content = payload.content
-    if payload.color is not None:
-        note.color = payload.color
-    if payload.tags is not None:
-        note.tags = payload.tags
-    if payload.archived is not None:
-        note.archived = payload.archived
-    await session.commit()
-    await session.refresh(note)
-    await broadcast_note_change(note)
+    # a note open in live editors changes through its document so their revisions stay in step
+    doc = documents.get(note.id)
+    async with doc.lock if doc is not None else nullcontext():
+        if doc is not None:
+            documents.sync(doc, note)
+        apply_note_update(note, payload, doc)
+        await bump_version(session, NOTE, current_user.id)
+        await session.commit()
+        if doc is not None:
+            doc.saved(note.updated_at)
+        await broadcast_note_change(note)
     return note
 
 
@@ -144,25 +501,58 @@ async def delete_note(note_id: UUID, current_user: User = Depends(get_current_us
     if not note or note.owner_id != current_user.id:
         raise HTTPException(status_code=404, detail="Note not found")
     await session.delete(note)
+    record_deletion(session, NOTE, note.id, current_user.id)
+    await bump_version(session, NOTE, current_user.id)
     await session.commit()
     await broadcast_note_delete(note_id)
     return None
 
 
 # Calendar REST
-@app.get("/calendar", response_model=list[CalendarEventOut])
-async def list_events(current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
-    result = await session.execute(
-        select(CalendarEvent).where(CalendarEvent.owner_id == current_user.id).order_by(CalendarEvent.start_time.desc())
+def event_window(start: datetime | None, end: datetime | None):
+    """Events of any kind overlapping [start, end); either bound may be open."""
+    start, end = (
+        value.astimezone(timezone.utc).replace(tzinfo=None) if value is not None and value.tzinfo else value
+        for value in (start, end)
     )
-    return result.scalars().all()
+    if start is not None and end is not None and end < start:
+        raise HTTPException(status_code=400, detail="'to' is before 'from'")
+    return CalendarEvent.span.op("&&")(func.tsrange(start, end, "[)"))
 
 
-@app.post("/calendar", response_model=CalendarEventOut, status_code=201)
-async def create_event(
-    payload: CalendarEventCreate, current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)
+@app.get("/calendar", response_model=list[CalendarEventOut])
+async def list_events(
+    request: Request,
+    start: datetime | None = Query(None, alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+    limit: int | None = Query(None, ge=1, le=500),
+    cursor: str | None = None,
+    fields: str | None = None,
+    if_none_match: str | None = Header(None),
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_read_session),
 ):
-    event = CalendarEvent(
+    projection = parse_fields(fields, list(CalendarEventOut.model_fields))
+    criteria = CalendarEvent.owner_id == current_user.id
+    if start is not None or end is not None:
+        criteria = criteria & event_window(start, end)
+    etag = await collection_etag(session, EVENT, current_user.id, request)
+    if (cached := not_modified(etag, if_none_match)) is not None:
+        return cached
+    rows, next_cursor = await fetch_page(
+        session,
+        CalendarEvent,
+        criteria,
+        CalendarEvent.start_time,
+        fields=projection,
+        limit=limit,
+        cursor=cursor,
+    )
+    return page_response(rows, next_cursor, projection, event_dict, etag)
+
+
+def new_event(payload: CalendarEventCreate, owner_id: UUID) -> CalendarEvent:
+    return CalendarEvent(
         title=payload.title,
         description=payload.description,
         is_all_day=payload.is_all_day,
@@ -170,25 +560,11 @@ async def create_event(
         end_time=payload.end_time if not payload.is_all_day else None,
         event_date=payload.event_date if payload.is_all_day else None,
         reminder_minutes=payload.reminder_minutes or "",
-        owner_id=current_user.id,
+        owner_id=owner_id,
     )
-    session.add(event)
-    await session.commit()
-    await session.refresh(event)
-    await broadcast_calendar_change({"action": "created", "event": serialize_event(event)})
-    return event
 
 
-@app.patch("/calendar/{event_id}", response_model=CalendarEventOut)
-async def update_event(
-    event_id: UUID,
-    payload: CalendarEventUpdate,
-    current_user: User = Depends(get_current_user),
-    session: AsyncSession = Depends(get_session),
-):
-    event = await session.get(CalendarEvent, event_id)
-    if not event or event.owner_id != current_user.id:
-        raise HTTPException(status_code=404, detail="Event not found")
+def apply_event_update(event: CalendarEvent, payload: CalendarEventUpdate) -> None:
     if payload.title is not None:
         event.title = payload.title
     if payload.description is not None:
@@ -206,9 +582,113 @@ async def update_event(
         event.event_date = payload.event_date
     if payload.reminder_minutes is not None:
         event.reminder_minutes = payload.reminder_minutes
+
+
+@app.post("/calendar", response_model=CalendarEventOut, status_code=201)
+async def create_event(
+    payload: CalendarEventCreate, current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)
+):
+    event = new_event(payload, current_user.id)
+    session.add(event)
+    fire_times = await schedule_reminders(session, [event], {current_user.id: current_user.timezone})
+    await bump_version(session, EVENT, current_user.id)
     await session.commit()
-    await session.refresh(event)
-    await broadcast_calendar_change({"action": "updated", "event": serialize_event(event)})
+    await reminder_scheduler.notify(fire_times)
+    await broadcast_calendar_change(current_user.id, {"action": "created", "event": event_dict(event)})
+    return event
+
+
+@app.post("/calendar/batch", response_model=list[CalendarEventBatchResult])
+async def batch_events(
+    payload: CalendarEventBatchRequest,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Apply create/update/delete operations in order, in one transaction, and
+    send the owner's calendar sockets a single "batch" message with the net
+    result.
+    """
+    ids = {op.id for op in payload.ops if op.op != "create"}
+    existing: dict[UUID, CalendarEvent] = {}
+    if ids:
+        result = await session.execute(
+            select(CalendarEvent).where(CalendarEvent.id.in_(ids) & (CalendarEvent.owner_id == current_user.id))
+        )
+        existing = {event.id: event for event in result.scalars()}
+
+    items: list[tuple[int, int, UUID | None, CalendarEvent | None]] = []
+    created: dict[int, CalendarEvent] = {}
+    updated: dict[UUID, CalendarEvent] = {}
+    deleted: list[UUID] = []
+    for index, op in enumerate(payload.ops):
+        if op.op == "create":
+            event = new_event(op.data, current_user.id)
+            session.add(event)
+            created[id(event)] = event
+            items.append((index, 201, None, event))
+            continue
+        event = existing.get(op.id)
+        if event is None:
+            items.append((index, 404, op.id, None))
+        elif op.op == "update":
+            apply_event_update(event, op.data)
+            updated[event.id] = event
+            items.append((index, 200, event.id, event))
+        else:
+            await session.delete(event)
+            record_deletion(session, EVENT, event.id, current_user.id)
+            del existing[event.id]
+            updated.pop(event.id, None)
+            deleted.append(event.id)
+            items.append((index, 204, event.id, None))
+    fire_times = await schedule_reminders(
+        session, [*created.values(), *updated.values()], {current_user.id: current_user.timezone}
+    )
+    await bump_version(session, EVENT, current_user.id)
+    await session.commit()
+    await reminder_scheduler.notify(fire_times)
+
+    if created or updated or deleted:
+        await broadcast_calendar_change(
+            current_user.id,
+            {
+                "action": "batch",
+                "created": [event_dict(event) for event in created.values()],
+                "updated": [event_dict(event) for event in updated.values()],
+                "deleted": [str(event_id) for event_id in deleted],
+            },
+        )
+
+    results = []
+    for index, code, event_id, event in items:
+        if code == 404:
+            results.append(CalendarEventBatchResult(index=index, status=code, id=event_id, error="Event not found"))
+        elif event is not None:
+            results.append(
+                CalendarEventBatchResult(index=index, status=code, id=event.id, event=CalendarEventOut.model_validate(event))
+            )
+        else:
+            results.append(CalendarEventBatchResult(index=index, status=code, id=event_id))
+    return results
+
+
+@app.patch("/calendar/{event_id}", response_model=CalendarEventOut)
+async def update_event(
+    event_id: UUID,
+    payload: CalendarEventUpdate,
+    current_user: User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    event = await session.get(CalendarEvent, event_id)
+    if not event or event.owner_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Event not found")
+    apply_event_update(event, payload)
+    fire_times = await schedule_reminders(session, [event], {current_user.id: current_user.timezone})
+    await bump_version(session, EVENT, current_user.id)
+    await session.commit()
+    await reminder_scheduler.notify(fire_times)
+    await broadcast_calendar_change(current_user.id, {"action": "updated", "event": event_dict(event)})
     return event
 
 
@@ -218,300 +698,352 @@ async def delete_event(event_id: UUID, current_user: User = Depends(get_current_
     if not event or event.owner_id != current_user.id:
         raise HTTPException(status_code=404, detail="Event not found")
     await session.delete(event)
+    record_deletion(session, EVENT, event.id, current_user.id)
+    await bump_version(session, EVENT, current_user.id)
     await session.commit()
-    await broadcast_calendar_change({"action": "deleted", "event_id": str(event_id)})
+    await broadcast_calendar_change(current_user.id, {"action": "deleted", "event_id": str(event_id)})
     return None
 
 
-# WebSocket state
-note_clients: dict[str, set[WebSocket]] = defaultdict(set)
-note_lock = asyncio.Lock()
-calendar_clients: set[WebSocket] = set()
-calendar_lock = asyncio.Lock()
+# Delta sync
+@app.get("/sync", response_model=SyncOut)
+async def sync(
+    since: str | None = None, current_user: User = Depends(get_current_user), session: AsyncSession = Depends(get_session)
+):
+    """Notes and events changed since the token from the previous sync (all of them without one)."""
+    return await changes_since(session, current_user.id, since)
 
 
+# WebSocket fan-out
 async def broadcast_note_change(note: Note):
-    message = json.dumps(
-        {
-            "type": "note_updated",
-            "id": str(note.id),
-            "title": note.title,
-            "content": note.content,
-            "updated_at": note.updated_at.isoformat(),
-        }
-    )
-    async with note_lock:
-        clients = list(note_clients.get(str(note.id), set()))
-    for ws in clients:
-        try:
-            await ws.send_text(message)
-        except Exception:
-            pass
+    """
+    After a committed REST write: send the note to this process's editors and
+    announce the write, which other workers merge into their live documents.
+    """
+    broadcaster.deliver(note_channel(note.id), note_state_message("note_updated", note))
+    await documents.stored(note.id, note.revision)
 
 
 async def broadcast_note_delete(note_id: UUID):
-    message = json.dumps({"type": "note_deleted", "id": str(note_id)})
-    async with note_lock:
-        clients = list(note_clients.get(str(note_id), set()))
-    for ws in clients:
-        try:
-            await ws.send_text(message)
-        except Exception:
-            pass
-
-
-def serialize_event(event: CalendarEvent) -> dict:
-    return {
-        "id": str(event.id),
-        "title": event.title,
-        "description": event.description,
-        "start_time": event.start_time.isoformat(),
-        "end_time": event.end_time.isoformat(),
-        "updated_at": event.updated_at.isoformat(),
-    }
+    message = dumps_text({"type": "note_deleted", "id": note_id})
+    await broadcaster.publish(note_channel(note_id), message)
 
 
-async def broadcast_calendar_change(payload: dict):
-    message = json.dumps({"type": "calendar", **payload})
-    async with calendar_lock:
-        clients = list(calendar_clients)
-    for ws in clients:
-        try:
-            await ws.send_text(message)
-        except Exception:
-            pass
+async def broadcast_calendar_change(owner_id: UUID, payload: dict):
+    message = dumps_text({"type": "calendar", **payload})
+    await broadcaster.publish(calendar_channel(owner_id), message)
 
 
-@app.websocket("/ws/notes/{note_id}")
-async def notes_ws(websocket: WebSocket, note_id: str, session: AsyncSession = Depends(get_session)):
-    await websocket.accept()
-    # simple token query param auth: ws://...?token=xxx
+async def authenticate_websocket(websocket: WebSocket, session: AsyncSession) -> User | None:
+    """Simple token query param auth: ws://...?token=xxx; closes the socket and returns None on failure."""
     token = websocket.query_params.get("token")
-    if not token:
+    user = await authenticate_token(token, session) if token else None
+    if user is None:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-        return
+    return user
+
+
+# WebSocket handlers do not hold a database session: one is opened for the
+# handshake (auth and init payload) and closed before the receive loop, and
+# live note edits are written by app.collab with sessions of their own, so
+# idle sockets do not pin pooled connections.
+async def join_note(websocket: WebSocket, user: User, note_id: str, session_id: str) -> NoteDocument | None:
+    """Open the live document of one of the user's notes, subscribe websocket to it and send "init"."""
     try:
-        from jose import jwt
+        note_id = UUID(str(note_id))
+    except ValueError:
+        return None
+    async with AsyncSessionLocal() as session:
+        # read from the primary, not a replica: the note seeds the live document
+        note = await session.get(Note, note_id)
+    if note is None or note.owner_id != user.id:
+        return None
+    doc = documents.open(note)
+    await broadcaster.subscribe(note_channel(note.id), websocket)
+    broadcaster.send(websocket, note_state_message("init", doc, session=session_id))
+    return doc
 
-        payload = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
-        username = payload.get("sub")
-        if not username:
-            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-            return
-        result = await session.execute(select(User).where(User.username == username))
-        user = result.scalar_one_or_none()
-        if user is None:
-            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-            return
-    except Exception:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+
+async def leave_note(websocket: WebSocket, doc: NoteDocument):
+    await broadcaster.unsubscribe(note_channel(doc.id), websocket)
+    await documents.close(doc.id)
+
+
+async def handle_note_message(websocket: WebSocket, doc: NoteDocument, session_id: str, payload: dict):
+    if payload.get("type") == "patch":
+        await apply_note_patch(websocket, doc, session_id, payload)
+    elif payload.get("type") == "update" and isinstance(payload.get("content", ""), str):
+        await apply_note_rewrite(doc, payload.get("content", ""), payload.get("title"))
+
+
+async def join_calendar(websocket: WebSocket, user: User, start: str | None, end: str | None, **init):
+    """
+    Subscribe websocket to the user's calendar and send "init" with the events
+    in the optional from/to window (ISO 8601), as in GET /calendar. Raises
+    ValueError or HTTPException for a malformed window, before subscribing.
+    """
+    window = [datetime.fromisoformat(value) if value else None for value in (start, end)]
+    criteria = CalendarEvent.owner_id == user.id
+    if any(window):
+        criteria = criteria & event_window(*window)
+    async with ReadSessionLocal() as session:
+        await broadcaster.subscribe(calendar_channel(user.id), websocket)
+        result = await session.execute(select(CalendarEvent).where(criteria))
+        events = [event_dict(ev) for ev in result.scalars()]
+    broadcaster.send(websocket, dumps_text({"type": "init", **init, "events": events}))
+
+
+async def receive_json(websocket: WebSocket) -> dict | None:
+    """
+    Next message as a JSON object; None for anything else, which handlers
+    ignore. Every message counts as a heartbeat; {"type": "pong"} answers
+    the broadcaster's pings and is not passed on.
+    """
+    data = await websocket.receive_text()
+    try:
+        payload = json.loads(data)
+    except json.JSONDecodeError:
+        payload = None
+    pong = isinstance(payload, dict) and payload.get("type") == "pong"
+    broadcaster.touch(websocket, pong=pong)
+    return payload if isinstance(payload, dict) and not pong else None
+
+
+@app.websocket("/ws/notes/{note_id}")
+async def notes_ws(websocket: WebSocket, note_id: str):
+    await websocket.accept()
+    async with AsyncSessionLocal() as session:
+        user = await authenticate_websocket(websocket, session)
+    if user is None:
         return
 
-    note = await session.get(Note, note_id)
-    if note is None or note.owner_id != user.id:
+    # Protocol: "init" carries the note, its revision and this socket's session id.
+    # Clients send {"type": "patch", "rev": <base revision>, "ops": [...], "title"?}
+    # with app.ot operations; every accepted patch is broadcast as "note_patch"
+    # (rebased, with its new rev and the sender's session as "origin"). A patch
+    # that cannot be rebased is answered with "resync" carrying the full note.
+    # The legacy {"type": "update", "content", "title"?} full rewrite still works
+    # and is broadcast as "note_updated".
+    session_id = secrets.token_hex(8)
+    doc = await join_note(websocket, user, note_id, session_id)
+    if doc is None:
         await websocket.send_text(json.dumps({"error": "not_found"}))
         await websocket.close()
         return
 
-    async with note_lock:
-        note_clients[str(note_id)].add(websocket)
-
-    await websocket.send_text(
-        json.dumps(
-            {
-                "type": "init",
-                "id": str(note.id),
-                "title": note.title,
-                "content": note.content,
-                "updated_at": note.updated_at.isoformat(),
-            }
-        )
-    )
-
     try:
         while True:
-            data = await websocket.receive_text()
-            try:
-                payload = json.loads(data)
-            except json.JSONDecodeError:
-                continue
-            if payload.get("type") == "update":
-                new_content = payload.get("content", "")
-                note.title = payload.get("title", note.title)
-                note.content = new_content
-                await session.commit()
-                await session.refresh(note)
-                await broadcast_note_change(note)
+            payload = await receive_json(websocket)
+            if payload is not None:
+                await handle_note_message(websocket, doc, session_id, payload)
     except WebSocketDisconnect:
         pass
     finally:
-        async with note_lock:
-            note_clients[str(note_id)].discard(websocket)
+        await leave_note(websocket, doc)
+
+
+async def apply_note_patch(websocket: WebSocket, doc: NoteDocument, origin: str, payload: dict):
+    async with doc.lock:
+        try:
+            ops = doc.apply(int(payload.get("rev")), ot.normalize(payload.get("ops")))
+        except (StaleRevision, ValueError, TypeError):
+            broadcaster.send(websocket, note_state_message("resync", doc))
+            return
+        if isinstance(payload.get("title"), str):
+            doc.title = payload["title"]
+        # revisions are per document, so patches go to this process's editors only
+        broadcaster.deliver(note_channel(doc.id), note_patch_message(doc, ops, origin))
+        await documents.changed(doc)
+
+
+async def apply_note_rewrite(doc: NoteDocument, content: str, title: str | None):
+    async with doc.lock:
+        doc.replace(content)
+        if isinstance(title, str):
+            doc.title = title
+        broadcaster.deliver(note_channel(doc.id), note_state_message("note_updated", doc))
+        await documents.changed(doc)
 
 
 @app.websocket("/ws/calendar")
-async def calendar_ws(websocket: WebSocket, session: AsyncSession = Depends(get_session)):
+async def calendar_ws(websocket: WebSocket):
     await websocket.accept()
-    token = websocket.query_params.get("token")
-    if not token:
+    async with ReadSessionLocal() as session:
+        user = await authenticate_websocket(websocket, session)
+    if user is None:
+        return
+
+    try:
+        await join_calendar(websocket, user, websocket.query_params.get("from"), websocket.query_params.get("to"))
+    except (ValueError, HTTPException):
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
+
     try:
-        from jose import jwt
+        while True:
+            await receive_json(websocket)  # heartbeats only; client pushes via REST
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await broadcaster.unsubscribe(calendar_channel(user.id), websocket)
 
-        payload = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
-        username = payload.get("sub")
-        if not username:
-            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-            return
-        result = await session.execute(select(User).where(User.username == username))
-        user = result.scalar_one_or_none()
-        if user is None:
-            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-            return
-    except Exception:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+
+@app.websocket("/ws")
+async def multiplexed_ws(websocket: WebSocket):
+    """
+    One socket, one handshake and one outbound queue for any number of notes
+    and the calendar, instead of a socket per note plus /ws/calendar.
+
+    After auth the server sends {"type": "ready", "session": <id>}. Clients then send
+      {"type": "subscribe" | "unsubscribe", "note": <id>}
+      {"type": "subscribe", "calendar": true, "from"?, "to"?} / {"type": "unsubscribe", "calendar": true}
+      {"type": "patch" | "update", "note": <id>, ...} as on /ws/notes for a subscribed note
+    and receive the messages of the per-resource sockets: note messages carry
+    the note "id", the calendar "init" carries "channel": "calendar". Refused
+    requests are answered with {"type": "error", "error": ..., "note"?, "calendar"?}.
+    A silent socket is sent {"type": "ping"} and must answer {"type": "pong"}
+    (or anything else) within ws_idle_timeout_seconds or it is closed.
+    """
+    await websocket.accept()
+    async with AsyncSessionLocal() as session:
+        user = await authenticate_websocket(websocket, session)
+    if user is None:
         return
 
-    async with calendar_lock:
-        calendar_clients.add(websocket)
+    session_id = secrets.token_hex(8)
+    notes: dict[str, NoteDocument] = {}
+    calendar = False
+    await broadcaster.attach(websocket)
+    broadcaster.send(websocket, dumps_text({"type": "ready", "session": session_id}))
 
-    # send initial events list for user
-    result = await session.execute(select(CalendarEvent).where(CalendarEvent.owner_id == user.id))
-    events = [serialize_event(ev) for ev in result.scalars().all()]
-    await websocket.send_text(json.dumps({"type": "init", "events": events}))
+    def error(code: str, **target):
+        broadcaster.send(websocket, dumps_text({"type": "error", "error": code, **target}))
 
     try:
         while True:
-            await websocket.receive_text()  # keep alive; client pushes via REST
+            payload = await receive_json(websocket)
+            if payload is None:
+                continue
+            kind = payload.get("type")
+            if payload.get("calendar") is True:
+                if kind == "subscribe" and not calendar:
+                    try:
+                        await join_calendar(websocket, user, payload.get("from"), payload.get("to"), channel="calendar")
+                    except (ValueError, TypeError, HTTPException):
+                        error("invalid_window", calendar=True)
+                        continue
+                    calendar = True
+                elif kind == "unsubscribe" and calendar:
+                    await broadcaster.unsubscribe(calendar_channel(user.id), websocket)
+                    calendar = False
+                continue
+
+            note_id = str(payload.get("note"))
+            try:
+                note_id = str(UUID(note_id))
+            except ValueError:
+                pass
+            doc = notes.get(note_id)
+            if kind == "subscribe":
+                if doc is not None:
+                    broadcaster.send(websocket, note_state_message("init", doc, session=session_id))
+                elif len(notes) >= settings.ws_max_notes_per_socket:
+                    error("too_many_subscriptions", note=note_id)
+                elif (doc := await join_note(websocket, user, note_id, session_id)) is None:
+                    error("not_found", note=note_id)
+                else:
+                    notes[note_id] = doc
+            elif doc is None:
+                if kind in ("unsubscribe", "patch", "update"):
+                    error("not_subscribed", note=note_id)
+            elif kind == "unsubscribe":
+                del notes[note_id]
+                await leave_note(websocket, doc)
+            else:
+                await handle_note_message(websocket, doc, session_id, payload)
     except WebSocketDisconnect:
         pass
     finally:
-        async with calendar_lock:
-            calendar_clients.discard(websocket)
+        await broadcaster.detach(websocket)
+        for doc in notes.values():
+            await documents.close(doc.id)
+
 
 # Updates endpoint for Tauri updater
+def cached_json(body: bytes, etag: str, if_none_match: str | None, cache_control: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
 @app.get("/api/updates/{target}/{arch}/{current_version}")
 @app.head("/api/updates/{target}/{arch}/{current_version}")
-async def check_update(target: str, arch: str, current_version: str):
+async def check_update(target: str, arch: str, current_version: str, if_none_match: str | None = Header(None)):
     """
     Endpoint dla Tauri updater plugin.
     target: windows, linux, macos
     arch: x86_64, aarch64
     current_version: aktualnie zainstalowana wersja (np. 0.1.0)
     """
-    import os
-    from pathlib import Path
-    import logging
-    
-    logger = logging.getLogger(__name__)
-    logger.info(f"Update check: target={target}, arch={arch}, current_version={current_version}")
-    
-    # Katalog ze storanymi build'ami (./updates/releases/)
-    updates_dir = Path(__file__).parent.parent / "updates" / "releases"
-    
-    # Porównanie semantyczne wersji
-    def parse_version(v: str):
-        try:
-            return tuple(map(int, v.split('.')))
-        except:
-            return (0, 0, 0)
-    
-    # Szukaj najnowszego pliku dla danego target/arch
-    pattern = f"notes-desktop_*_{arch}-pc-{target}-msvc.msi.zip"
-    files = list(updates_dir.glob(pattern))
-    
-    if not files:
+    logger.debug("Update check: target=%s, arch=%s, current_version=%s", target, arch, current_version)
+
+    manifest = release_index.manifest(target, arch)
+    if manifest is None:
         return {"url": "", "version": current_version, "notes": "Aktualizacja niedostępna", "pub_date": ""}
-    
-    # Sortuj po wersji (filename to notes-desktop_X.Y.Z_...)
-    def extract_version(fname: Path) -> tuple:
-        try:
-            parts = fname.stem.split('_')
-            return parse_version(parts[1])
-        except:
-            return (0, 0, 0)
-    
-    latest_file = max(files, key=extract_version)
-    latest_version = extract_version(latest_file)
-    
-    # Przygotuj odpowiedź JSON
-    if parse_version(current_version) >= latest_version:
-        response_data = {"url": "", "version": current_version, "notes": "Już masz najnowszą wersję", "pub_date": "", "signature": ""}
+
+    installed = parse_version(current_version)
+    if installed >= manifest.latest.version:
+        body = json.dumps(
+            {"url": "", "version": current_version, "notes": "Już masz najnowszą wersję", "pub_date": "", "signature": ""}
+        ).encode()
+        etag = etag_for(body)
     else:
-        response_data = {
-            "url": f"https://api.vamare.pl/api/updates/download/{latest_file.name}",
-            "version": ".".join(map(str, latest_version)),
-            "notes": "Nowa wersja zawiera poprawki i ulepszenia",
-            "pub_date": datetime.utcnow().isoformat() + "Z",
-            "signature": "",
-        }
-    
-    # Zwróć z nagłówkami wyłączającymi cache
-    return JSONResponse(
-        content=response_data,
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        }
-    )
+        # with a patch from the installed version when one exists, the full package otherwise
+        body, etag = manifest.answer(installed)
+
+    # clients must revalidate every time, but an unchanged answer costs only a 304
+    return cached_json(body, etag, if_none_match, "no-cache")
 
 
 @app.get("/api/version-info")
-async def get_version_info():
+async def get_version_info(if_none_match: str | None = Header(None)):
     """
     Zwraca informacje o najnowszej dostępnej wersji.
     Używane przez frontend do sprawdzania czy jest update.
     """
-    from pathlib import Path
-    import re
-    
-    updates_dir = Path(__file__).parent.parent / "updates" / "releases"
-    if not updates_dir.exists():
-        return {"latest_version": "0.3.3", "download_url": None}
-    
-    # Szukaj najnowszego pliku MSI
-    msi_files = list(updates_dir.glob("notes-desktop_*.msi.zip"))
-    if not msi_files:
-        return {"latest_version": "0.3.3", "download_url": None}
-    
-    # Sortuj po wersji
-    def extract_version(filename: str):
-        match = re.search(r'notes-desktop_(\d+\.\d+\.\d+)', filename)
-        if match:
-            parts = match.group(1).split('.')
-            return tuple(int(p) for p in parts)
-        return (0, 0, 0)
-    
-    latest_file = max(msi_files, key=lambda f: extract_version(f.name))
-    version_match = re.search(r'notes-desktop_(\d+\.\d+\.\d+)', latest_file.name)
-    latest_version = version_match.group(1) if version_match else "0.3.3"
-    
-    return {
-        "latest_version": latest_version,
-        "download_url": f"https://api.vamare.pl/api/updates/download/{latest_file.name}",
-        "current_file": latest_file.name
-    }
+    release_index.refresh()
+    return cached_json(
+        release_index.version_info,
+        release_index.version_info_etag,
+        if_none_match,
+        f"public, max-age={settings.version_info_max_age}",
+    )
 
 
 @app.get("/api/updates/download/{filename}")
 @app.head("/api/updates/download/{filename}")
-async def download_update(filename: str):
+async def download_update(filename: str, request: Request, if_none_match: str | None = Header(None)):
     """
     Pobieranie pliku aktualizacji.
+    Obsługuje Range/If-Range (wznawianie przerwanych pobrań).
     """
-    from fastapi.responses import FileResponse
-    import os
-    from pathlib import Path
-    
-    # Zabezpieczenie: sprawdzenie, że filename to znany plik
-    updates_dir = Path(__file__).parent.parent / "updates" / "releases"
-    file_path = (updates_dir / filename).resolve()
-    updates_dir = updates_dir.resolve()
-    
-    # Sprawdzenie, czy plik istnieje i jest w updates/releases/
-    if not file_path.exists() or not str(file_path).startswith(str(updates_dir)):
+    # only packages present in the release index can be downloaded
+    release = release_index.get(filename)
+    if release is None:
         raise HTTPException(status_code=404, detail="Update file not found")
-    
-    return FileResponse(file_path, media_type="application/zip", filename=filename)
\ No newline at end of file
+
+    etag = await release_index.content_etag(release)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    if settings.update_accel_redirect_prefix:
+        # the front proxy serves the file itself (sendfile, ranges); this worker only authorizes it
+        return Response(
+            headers={
+                "X-Accel-Redirect": settings.update_accel_redirect_prefix + release.filename,
+                "Content-Type": "application/zip",
+                "Content-Disposition": f'attachment; filename="{release.filename}"',
+            }
+        )
+    client = request.client.host if request.client else "unknown"
+    return ReleaseFileResponse(release, etag, download_limiter, client)
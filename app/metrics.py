@@ -0,0 +1,279 @@
+import asyncio
+import bisect
+import contextvars
+import os
+import time
+from typing import Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # per label set: [per-bucket counts (not cumulative), sum, count]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Gauge:
+    """Gauge read at scrape time; fn returns a number or a {label values: number} dict."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = labelnames
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            if not isinstance(labels, tuple):
+                labels = (labels,)
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class CounterFunc(Gauge):
+    """Counter read at scrape time, for totals a component keeps itself."""
+
+    type = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def stats(self, prefix: str, fn: Callable[[], dict], counters: tuple = ()) -> None:
+        """Expose every numeric entry of a component's stats() dict as prefix_<key>.
+
+        Keys listed in counters only ever grow and are typed as counters, so
+        rate() applies to them; the rest are gauges.
+        """
+        for key, value in fn().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metric = CounterFunc if key in counters else Gauge
+                self.register(metric(f"{prefix}_{key}", f"{prefix} {key}", lambda key=key: fn()[key]))
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode()
+
+
+registry = Registry()
+
+http_requests = registry.register(
+    Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+)
+http_latency = registry.register(
+    Histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+)
+db_queries = registry.register(Counter("db_queries_total", "Database statements executed", ("engine",)))
+db_latency = registry.register(Histogram("db_query_duration_seconds", "Database statement latency", ("engine",)))
+db_queries_per_request = registry.register(
+    Histogram("db_queries_per_request", "Database statements per HTTP request", ("method", "route"), COUNT_BUCKETS)
+)
+db_seconds_per_request = registry.register(
+    Histogram("db_seconds_per_request", "Database time per HTTP request", ("method", "route"))
+)
+ws_connections = registry.register(Counter("ws_connections_total", "WebSocket connections handled (counted on close), by route", ("route",)))
+ws_reaped = registry.register(
+    Counter("ws_connections_reaped_total", "WebSocket connections reaped by the heartbeat pass, by reason", ("reason",))
+)
+broadcast_fanout = registry.register(
+    Histogram("ws_broadcast_fanout", "Local recipients per broadcast message", ("kind",), COUNT_BUCKETS)
+)
+event_loop_lag = registry.register(Histogram("event_loop_lag_seconds", "Event loop scheduling delay"))
+
+# [statements, seconds] of the current HTTP request, if any
+_request_db: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_db", default=None)
+
+
+def instrument_engine(engine: AsyncEngine, name: str) -> None:
+    """Count and time every statement, and report pool utilization under engine=name."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        db_queries.inc(name)
+        db_latency.observe(elapsed, name)
+        current = _request_db.get()
+        if current is not None:
+            current[0] += 1
+            current[1] += elapsed
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        # a failed statement never reaches after_cursor_execute; drop its start
+        # time so the next statement on this connection is not timed from it
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+    _pools[name] = sync_engine.pool
+
+
+def _pool_connections() -> dict:
+    values = {}
+    for name, pool in _pools.items():
+        values[(name, "checked_out")] = pool.checkedout()
+        values[(name, "idle")] = pool.checkedin()
+        values[(name, "overflow")] = max(pool.overflow(), 0)
+    return values
+
+
+_pools: dict = {}
+registry.register(Gauge("db_pool_connections", "Connection pool connections by state", _pool_connections, ("engine", "state")))
+registry.register(
+    Gauge("db_pool_size", "Connection pool size", lambda: {name: pool.size() for name, pool in _pools.items()}, ("engine",))
+)
+
+
+def _resident_memory() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+registry.register(Gauge("process_resident_memory_bytes", "Resident memory of this worker", _resident_memory))
+
+
+class MetricsMiddleware:
+    """Per-route request count, latency and database usage; WebSocket connections are counted per route."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "websocket":
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                ws_connections.inc(_route(scope))
+            return
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+        db = [0, 0.0]
+        token = _request_db.set(db)
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_db.reset(token)
+            route = _route(scope)
+            method = scope["method"]
+            http_requests.inc(method, route, status_code)
+            http_latency.observe(time.perf_counter() - started, method, route)
+            db_queries_per_request.observe(db[0], method, route)
+            db_seconds_per_request.observe(db[1], method, route)
+
+
+def _route(scope: Scope) -> str:
+    # the path template, so per-id URLs share one series; unmatched paths are lumped together
+    route = scope.get("route")
+    return route.path if route is not None else "<unmatched>"
+
+
+async def watch_event_loop(interval: float = 0.5) -> None:
+    """Record how late the loop wakes up from a timer; sustained lag means blocking work on the loop."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - started - interval, 0.0)
+        event_loop_lag.observe(lag)
@@ -1,9 +1,11 @@
 import uuid
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, ForeignKey, String, Text, Boolean, Date
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy import BigInteger, Column, Computed, DateTime, ForeignKey, Index, Integer, String, Text, Boolean, Date, false
+from sqlalchemy.dialects.postgresql import ARRAY, TSRANGE, TSVECTOR, UUID
+from sqlalchemy.orm import declarative_base, deferred, relationship
+
+from .config import settings
 
 Base = declarative_base()
 
@@ -18,6 +20,8 @@ class User(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     username = Column(String(150), unique=True, nullable=False, index=True)
     hashed_password = Column(String(255), nullable=False)
+    # IANA name; calendar event times are wall-clock times in this zone
+    timezone = Column(String(64), default=settings.default_timezone, server_default=settings.default_timezone, nullable=False)
     created_at = Column(DateTime, default=utcnow, nullable=False)
 
     notes = relationship("Note", back_populates="owner", cascade="all, delete")
@@ -33,11 +37,29 @@ class Note(Base):
     color = Column(String(7), nullable=True, default=None)  # hex color, e.g. #ffffff
     tags = Column(Text, nullable=True, default="")  # comma-separated tags
     archived = Column(Boolean, default=False, nullable=False)  # archival status
+    revision = Column(Integer, default=0, server_default="0", nullable=False)  # bumped on every content change
     owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     updated_at = Column(DateTime, default=utcnow, onupdate=utcnow, nullable=False)
+    # maintained by Postgres on every write; backs GET /notes/search
+    search_vector = deferred(
+        Column(TSVECTOR, Computed("to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(content, ''))", persisted=True))
+    )
+    tag_list = Column(
+        ARRAY(Text),
+        Computed("array_remove(regexp_split_to_array(lower(btrim(coalesce(tags, ''))), '\\s*,\\s*'), '')", persisted=True),
+    )  # normalized tags: lower-case, trimmed, no empties
 
     owner = relationship("User", back_populates="notes")
 
+    __table_args__ = (
+        # keyset pagination of list_notes / list_archived_notes: (updated_at, id) DESC per owner
+        Index("ix_notes_owner_archived_updated", "owner_id", "archived", "updated_at", "id"),
+        # GET /sync: notes changed since a watermark, archived or not
+        Index("ix_notes_owner_updated", "owner_id", "updated_at"),
+        Index("ix_notes_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_notes_tag_list", "tag_list", postgresql_using="gin"),
+    )
+
 
 class CalendarEvent(Base):
     __tablename__ = "calendar_events"
@@ -45,12 +67,84 @@ class CalendarEvent(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     title = Column(String(255), nullable=False)
     description = Column(Text, nullable=True)
-    start_time = Column(DateTime, nullable=True)  # nullable for all-day events
+    start_time = Column(DateTime, nullable=True)  # nullable for all-day events; owner's local time
     end_time = Column(DateTime, nullable=True)    # nullable for all-day events
     is_all_day = Column(Boolean, default=False, nullable=False)  # all-day flag
     event_date = Column(Date, nullable=True)  # date for all-day events
     reminder_minutes = Column(String(255), nullable=True, default="")  # e.g., "15,60" for 15min and 1hr
+    # the reminders table reflects this event; false only for rows older than that table,
+    # until ReminderScheduler backfills them
+    reminders_scheduled = Column(Boolean, default=True, server_default=false(), nullable=False)
     owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     updated_at = Column(DateTime, default=utcnow, onupdate=utcnow, nullable=False)
+    # time covered by the event, for range queries over timed and all-day events alike:
+    # [start_time, end_time] for timed events, [event_date, event_date + 1 day) for all-day ones
+    span = deferred(
+        Column(
+            TSRANGE,
+            Computed(
+                "CASE WHEN is_all_day AND event_date IS NOT NULL "
+                "THEN tsrange(event_date::timestamp, (event_date + 1)::timestamp, '[)') "
+                "WHEN start_time IS NOT NULL "
+                "THEN tsrange(start_time, greatest(coalesce(end_time, start_time), start_time), '[]') END",
+                persisted=True,
+            ),
+        )
+    )
 
     owner = relationship("User", back_populates="events")
+
+    __table_args__ = (
+        # keyset pagination of list_events: (start_time, id) DESC per owner
+        Index("ix_calendar_events_owner_start", "owner_id", "start_time", "id"),
+        # GET /sync: events changed since a watermark
+        Index("ix_calendar_events_owner_updated", "owner_id", "updated_at"),
+        # GET /calendar?from=&to=: span overlaps the requested window
+        Index("ix_calendar_events_span", "span", postgresql_using="gist"),
+        # reminder backfill; empty once it is done
+        Index("ix_calendar_events_unscheduled", "id", postgresql_where=~reminders_scheduled),
+    )
+
+
+class Tombstone(Base):
+    """Record of a deleted note or event, kept so GET /sync can report deletions."""
+
+    __tablename__ = "tombstones"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    entity_type = Column(String(16), nullable=False)  # "note" or "event"
+    entity_id = Column(UUID(as_uuid=True), nullable=False)
+    owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    deleted_at = Column(DateTime, default=utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_tombstones_owner_deleted", "owner_id", "deleted_at"),
+    )
+
+
+class CollectionVersion(Base):
+    """Per-user change counter of the notes or the events, behind the ETags of their list endpoints."""
+
+    __tablename__ = "collection_versions"
+
+    owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    collection = Column(String(16), primary_key=True)  # "note" or "event"
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+class Reminder(Base):
+    """A pending reminder of a calendar event, derived from its reminder_minutes."""
+
+    __tablename__ = "reminders"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    event_id = Column(UUID(as_uuid=True), ForeignKey("calendar_events.id", ondelete="CASCADE"), nullable=False)
+    owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    minutes = Column(Integer, nullable=False)  # minutes before the event start
+    fire_at = Column(DateTime, nullable=False)  # UTC
+
+    __table_args__ = (
+        # the scheduler's "next due" scan
+        Index("ix_reminders_fire_at", "fire_at", "event_id"),
+        Index("ix_reminders_event", "event_id"),
+    )
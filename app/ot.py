@@ -0,0 +1,148 @@
+"""
+Plain-text operational transform.
+
+An operation is a list of components applied left to right over the whole
+document: a positive int retains that many characters, a negative int
+deletes that many, and a string inserts itself. Lengths count UTF-16 code
+units, as JavaScript string lengths do, so a character outside the BMP
+(e.g. most emoji) counts as two. The format matches ot.js, e.g.
+[5, "abc", -2, 10].
+"""
+
+
+def length(text: str) -> int:
+    """Length of text in UTF-16 code units."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _push(ops: list, component) -> None:
+    if component == 0 or component == "":
+        return
+    if ops:
+        last = ops[-1]
+        if isinstance(component, str) and isinstance(last, str):
+            ops[-1] = last + component
+            return
+        if isinstance(component, int) and isinstance(last, int) and (component > 0) == (last > 0):
+            ops[-1] = last + component
+            return
+        # keep inserts before deletes so equivalent operations compare equal
+        if isinstance(component, str) and isinstance(last, int) and last < 0:
+            ops.pop()
+            _push(ops, component)
+            ops.append(last)
+            return
+    ops.append(component)
+
+
+def normalize(ops) -> list:
+    """Validate a client-supplied operation and merge adjacent components."""
+    if not isinstance(ops, list):
+        raise ValueError("operation must be a list")
+    result: list = []
+    for component in ops:
+        if isinstance(component, bool) or not isinstance(component, (int, str)):
+            raise ValueError(f"invalid operation component: {component!r}")
+        _push(result, component)
+    return result
+
+
+def base_length(ops: list) -> int:
+    return sum(abs(c) for c in ops if isinstance(c, int))
+
+
+def target_length(ops: list) -> int:
+    return sum(c if isinstance(c, int) and c > 0 else length(c) for c in ops if not (isinstance(c, int) and c < 0))
+
+
+def apply(text: str, ops: list) -> str:
+    """
+    Apply ops to text. Raises ValueError if the lengths do not match or a
+    retain or delete ends inside a surrogate pair.
+    """
+    units = text.encode("utf-16-le")
+    if base_length(ops) * 2 != len(units):
+        raise ValueError("operation does not match document length")
+    parts = []
+    pos = 0
+    for component in ops:
+        if isinstance(component, str):
+            parts.append(component.encode("utf-16-le"))
+        elif component > 0:
+            parts.append(units[pos:pos + component * 2])
+            pos += component * 2
+        else:
+            pos -= component * 2
+    return b"".join(parts).decode("utf-16-le")
+
+
+def transform(a: list, b: list) -> tuple[list, list]:
+    """
+    Transform concurrent operations a and b (same base document) into a', b'
+    so that apply(apply(s, a), b') == apply(apply(s, b), a'). Inserts of a
+    at the same position are placed before those of b.
+    """
+    if base_length(a) != base_length(b):
+        raise ValueError("concurrent operations have different base lengths")
+    a_prime: list = []
+    b_prime: list = []
+    ia = ib = 0
+    op1 = a[0] if a else None
+    op2 = b[0] if b else None
+
+    def next_a():
+        nonlocal ia
+        ia += 1
+        return a[ia] if ia < len(a) else None
+
+    def next_b():
+        nonlocal ib
+        ib += 1
+        return b[ib] if ib < len(b) else None
+
+    while op1 is not None or op2 is not None:
+        if isinstance(op1, str):
+            _push(a_prime, op1)
+            _push(b_prime, length(op1))
+            op1 = next_a()
+            continue
+        if isinstance(op2, str):
+            _push(a_prime, length(op2))
+            _push(b_prime, op2)
+            op2 = next_b()
+            continue
+        if op1 is None or op2 is None:
+            raise ValueError("operations cannot be transformed")
+        n = min(abs(op1), abs(op2))
+        if op1 > 0 and op2 > 0:
+            _push(a_prime, n)
+            _push(b_prime, n)
+        elif op1 < 0 and op2 > 0:
+            _push(a_prime, -n)
+        elif op1 > 0 and op2 < 0:
+            _push(b_prime, -n)
+        # both delete the same span: nothing left to do on either side
+        op1 = op1 - n if op1 > 0 else op1 + n
+        op2 = op2 - n if op2 > 0 else op2 + n
+        if op1 == 0:
+            op1 = next_a()
+        if op2 == 0:
+            op2 = next_b()
+    return a_prime, b_prime
+
+
+def replace(old: str, new: str) -> list:
+    """Operation that turns old into new, trimming the common prefix and suffix."""
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    ops: list = []
+    _push(ops, length(old[:prefix]))
+    _push(ops, new[prefix:len(new) - suffix])
+    _push(ops, -length(old[prefix:len(old) - suffix]))
+    _push(ops, length(old[len(old) - suffix:]))
+    return ops
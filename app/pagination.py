@@ -0,0 +1,88 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Optional
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(value: Optional[datetime], row_id: UUID) -> str:
+    raw = json.dumps([value.isoformat() if value is not None else None, str(row_id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[Optional[datetime], UUID]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return (datetime.fromisoformat(value) if value is not None else None), UUID(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_fields(fields: Optional[str], allowed: list[str]) -> Optional[list[str]]:
+    """Parse a comma-separated ?fields= projection; None means all fields."""
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return [f for f in allowed if f in requested]
+
+
+def keyset_after(column, id_column, value: Optional[datetime], row_id: UUID):
+    """
+    Rows that follow (value, row_id) in ORDER BY column DESC, id DESC.
+    PostgreSQL sorts NULLs first in descending order, so a NULL sort key
+    continues into the NULL group by id and then into all non-NULL rows.
+    """
+    if value is None:
+        return or_(and_(column.is_(None), id_column < row_id), column.is_not(None))
+    return tuple_(column, id_column) < tuple_(value, row_id)
+
+
+async def fetch_page(
+    session: AsyncSession,
+    model,
+    criteria,
+    sort_column,
+    fields: Optional[list[str]] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> tuple[list[Any], Optional[str]]:
+    """
+    Run a keyset-paginated listing of model ordered by sort_column DESC, id DESC.
+
+    Returns ORM instances, or plain dicts restricted to fields when a
+    projection is requested, together with the cursor of the next page
+    (None on the last page or when no limit is given).
+    """
+    if fields is None:
+        stmt = select(model)
+    else:
+        columns = [getattr(model, f) for f in fields]
+        extra = [c for c in (sort_column, model.id) if c.key not in fields]
+        stmt = select(*columns, *extra)
+    stmt = stmt.where(criteria).order_by(sort_column.desc(), model.id.desc())
+    if cursor:
+        stmt = stmt.where(keyset_after(sort_column, model.id, *decode_cursor(cursor)))
+    if limit is not None:
+        stmt = stmt.limit(limit + 1)
+
+    result = await session.execute(stmt)
+    rows = list(result.scalars().all()) if fields is None else list(result.all())
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), last.id)
+    if fields is not None:
+        rows = [{f: getattr(row, f) for f in fields} for row in rows]
+    return rows, next_cursor
@@ -0,0 +1,389 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Optional
+
+from fastapi import WebSocket, status
+from starlette.websockets import WebSocketState
+
+from .cache import get_redis
+from .config import settings
+from .metrics import broadcast_fanout, ws_reaped
+
+logger = logging.getLogger(__name__)
+
+
+def note_channel(note_id) -> str:
+    return f"note:{note_id}"
+
+
+def calendar_channel(owner_id) -> str:
+    return f"calendar:{owner_id}"
+
+
+def channel_kind(channel: str) -> str:
+    return channel.split(":", 1)[0]
+
+
+PING = '{"type": "ping"}'
+
+
+class Connection:
+    """
+    Outbound side of one WebSocket: a bounded queue drained by its own writer task.
+
+    The bound is queue_size plus one slot per subscription, so a socket
+    subscribed to many channels (see Broadcaster.attach) survives a burst
+    that touches all of them at once, e.g. a /notes/batch update.
+    """
+
+    def __init__(self, ws: WebSocket, queue_size: int):
+        self.ws = ws
+        self.queue_size = queue_size
+        self.queue: asyncio.Queue[str] = asyncio.Queue()
+        self.channels: set[str] = set()
+        self.writer: Optional[asyncio.Task] = None
+        self.pinned = False  # kept open while it has no subscriptions (see Broadcaster.attach)
+        self.last_seen = time.monotonic()  # last inbound message
+        self.heartbeat = False  # answers pings, so silence means the client is gone
+
+    def full(self) -> bool:
+        return self.queue.qsize() >= self.queue_size + len(self.channels)
+
+
+class Broadcaster:
+    """
+    Fan-out of WebSocket messages by channel name.
+
+    Subscriptions are always local to the process; publish() decides how a
+    message reaches subscribers. The base class delivers in-process only,
+    which is correct for a single worker. listen() hands the messages of a
+    channel to a callback instead of sockets, for state the processes keep
+    in step among themselves.
+
+    Delivery never awaits a socket: each message is queued on every
+    recipient's bounded outbound queue and written by that connection's
+    writer task, so sends to different clients run concurrently and off the
+    publisher's request. A connection whose queue is full or whose send
+    fails or exceeds send_timeout is evicted and closed.
+
+    Every ping_interval seconds connections that have been silent that long
+    are sent {"type": "ping"}; clients answer {"type": "pong"} (handlers
+    report inbound messages with touch()). Connections that answer pings
+    and the multiplexed sockets of attach() are reaped once silent for
+    idle_timeout; any connection whose socket is already gone is reaped on
+    the same pass, and channels left without subscribers are dropped.
+    """
+
+    def __init__(self, queue_size: int, send_timeout: float, ping_interval: float = 0, idle_timeout: float = 0):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self._reaper: Optional[asyncio.Task] = None
+        self._channels: dict[str, set[Connection]] = {}
+        self._connections: dict[WebSocket, Connection] = {}
+        self._listeners: dict[str, Callable[[str], None]] = {}
+        self._lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task] = set()
+        self.dropped = 0
+        self.evicted = 0
+        self.reaped = 0
+        self.sent = 0
+        self.send_seconds_total = 0.0
+        self.send_seconds_max = 0.0
+
+    async def start(self) -> None:
+        if self.ping_interval > 0:
+            self._reaper = asyncio.create_task(self._reap_periodically())
+
+    async def stop(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for conn in list(self._connections.values()):
+            conn.writer.cancel()
+        self._connections.clear()
+        self._channels.clear()
+        self._listeners.clear()
+
+    async def attach(self, ws: WebSocket) -> None:
+        """
+        Open the outbound queue of ws ahead of any subscription and keep it
+        open when the last one is dropped, for sockets whose subscriptions
+        come and go; detach() closes it.
+        """
+        async with self._lock:
+            conn = self._connect(ws)
+            conn.pinned = conn.heartbeat = True
+
+    async def detach(self, ws: WebSocket) -> None:
+        """Drop every subscription of ws and its outbound queue, leaving the socket itself open."""
+        async with self._lock:
+            conn = self._connections.get(ws)
+            if conn is None:
+                return
+            for channel in list(conn.channels):
+                await self._detach(conn, channel)
+            self._close(conn)
+
+    async def subscribe(self, channel: str, ws: WebSocket) -> None:
+        async with self._lock:
+            conn = self._connect(ws)
+            if channel not in self._channels:
+                await self._channel_opened(channel)
+                self._channels[channel] = set()
+            self._channels[channel].add(conn)
+            conn.channels.add(channel)
+
+    async def unsubscribe(self, channel: str, ws: WebSocket) -> None:
+        async with self._lock:
+            conn = self._connections.get(ws)
+            if conn is None or channel not in conn.channels:
+                return
+            await self._detach(conn, channel)
+            if not conn.channels and not conn.pinned:
+                self._close(conn)
+
+    async def listen(self, channel: str, callback: Callable[[str], None]) -> None:
+        """Call callback with every message published on channel, by this process or any other."""
+        async with self._lock:
+            self._listeners[channel] = callback
+            await self._channel_opened(channel)
+
+    async def evict(self, ws: WebSocket, code: int = status.WS_1013_TRY_AGAIN_LATER) -> None:
+        """Drop every subscription of ws and close it."""
+        if await self._remove(ws, code):
+            self.evicted += 1
+
+    def touch(self, ws: WebSocket, pong: bool = False) -> None:
+        """Record an inbound message on ws; a pong marks the client as answering pings."""
+        conn = self._connections.get(ws)
+        if conn is not None:
+            conn.last_seen = time.monotonic()
+            conn.heartbeat = conn.heartbeat or pong
+
+    async def reap(self) -> None:
+        """One heartbeat pass: reap dead and timed-out connections, ping silent ones, drop empty channels."""
+        now = time.monotonic()
+        for conn in list(self._connections.values()):
+            silent = now - conn.last_seen
+            if WebSocketState.DISCONNECTED in (conn.ws.client_state, conn.ws.application_state):
+                reason = "disconnected"
+            elif conn.heartbeat and self.idle_timeout > 0 and silent > self.idle_timeout:
+                reason = "idle"
+            else:
+                if silent >= self.ping_interval:
+                    self._offer(conn, PING)
+                continue
+            if await self._remove(conn.ws, status.WS_1001_GOING_AWAY):
+                self.reaped += 1
+                ws_reaped.inc(reason)
+        async with self._lock:
+            for channel in [channel for channel, conns in self._channels.items() if not conns]:
+                del self._channels[channel]
+                await self._channel_closed(channel)
+
+    async def publish(self, channel: str, message: str) -> None:
+        self.deliver(channel, message)
+
+    def deliver(self, channel: str, message: str) -> None:
+        """Queue message for this process's subscribers of channel."""
+        listener = self._listeners.get(channel)
+        if listener is not None:
+            listener(message)
+            return
+        recipients = list(self._channels.get(channel, ()))
+        broadcast_fanout.observe(len(recipients), channel_kind(channel))
+        for conn in recipients:
+            self._offer(conn, message)
+
+    def send(self, ws: WebSocket, message: str) -> None:
+        """Queue message for one subscribed socket, ordered with its broadcasts."""
+        conn = self._connections.get(ws)
+        if conn is not None:
+            self._offer(conn, message)
+
+    def channel_counts(self) -> dict[str, tuple[int, int]]:
+        """{channel kind: (channels, subscriptions)} in this process."""
+        counts: dict[str, tuple[int, int]] = {}
+        for channel, conns in self._channels.items():
+            channels, subscriptions = counts.get(channel_kind(channel), (0, 0))
+            counts[channel_kind(channel)] = (channels + 1, subscriptions + len(conns))
+        return counts
+
+    def stats(self) -> dict:
+        depths = [conn.queue.qsize() for conn in self._connections.values()]
+        return {
+            "connections": len(self._connections),
+            "channels": len(self._channels),
+            "queue_depth": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "reaped": self.reaped,
+            "send_seconds_total": round(self.send_seconds_total, 6),
+            "send_seconds_max": round(self.send_seconds_max, 6),
+        }
+
+    def _offer(self, conn: Connection, message: str) -> None:
+        if conn.full():
+            self.dropped += 1
+            self._spawn(self.evict(conn.ws))
+            return
+        conn.queue.put_nowait(message)
+
+    async def _write(self, conn: Connection) -> None:
+        while True:
+            message = await conn.queue.get()
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(conn.ws.send_text(message), self.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._spawn(self.evict(conn.ws))
+                return
+            elapsed = time.perf_counter() - started
+            self.sent += 1
+            self.send_seconds_total += elapsed
+            self.send_seconds_max = max(self.send_seconds_max, elapsed)
+
+    async def _reap_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            try:
+                await self.reap()
+            except Exception:
+                logger.exception("WebSocket reaping failed")
+
+    async def _remove(self, ws: WebSocket, code: int) -> bool:
+        async with self._lock:
+            conn = self._connections.get(ws)
+            if conn is None:
+                return False
+            for channel in list(conn.channels):
+                await self._detach(conn, channel)
+            self._close(conn)
+        try:
+            await ws.close(code=code)
+        except Exception:
+            pass
+        return True
+
+    def _connect(self, ws: WebSocket) -> Connection:
+        conn = self._connections.get(ws)
+        if conn is None:
+            conn = self._connections[ws] = Connection(ws, self.queue_size)
+            conn.writer = asyncio.create_task(self._write(conn))
+        return conn
+
+    async def _detach(self, conn: Connection, channel: str) -> None:
+        conn.channels.discard(channel)
+        clients = self._channels.get(channel)
+        if clients is None:
+            return
+        clients.discard(conn)
+        if not clients:
+            del self._channels[channel]
+            await self._channel_closed(channel)
+
+    def _close(self, conn: Connection) -> None:
+        del self._connections[conn.ws]
+        if conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _channel_opened(self, channel: str) -> None:
+        pass
+
+    async def _channel_closed(self, channel: str) -> None:
+        pass
+
+
+class RedisBroadcaster(Broadcaster):
+    """
+    Cross-process fan-out over Redis pub/sub.
+
+    Each process subscribes only to the Redis channels it has local sockets
+    for, so a message is delivered to exactly the workers that need it.
+    Publishers do not deliver locally; their own subscription echoes the
+    message back, which keeps ordering identical for every recipient.
+    """
+
+    def __init__(self, prefix: str, **options):
+        super().__init__(**options)
+        self.prefix = prefix
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._active = asyncio.Event()
+
+    async def start(self) -> None:
+        await super().start()
+        self._pubsub = get_redis().pubsub()
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        await super().stop()
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    async def publish(self, channel: str, message: str) -> None:
+        try:
+            await get_redis().publish(self.prefix + channel, message)
+        except Exception:
+            logger.warning("Redis publish failed, delivering locally only", exc_info=True)
+            self.deliver(channel, message)
+
+    async def _channel_opened(self, channel: str) -> None:
+        await self._pubsub.subscribe(self.prefix + channel)
+        self._active.set()
+
+    async def _channel_closed(self, channel: str) -> None:
+        await self._pubsub.unsubscribe(self.prefix + channel)
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    self._active.clear()
+                    await self._active.wait()
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Redis pub/sub receive failed", exc_info=True)
+                await asyncio.sleep(1.0)
+                continue
+            if message and message["type"] == "message":
+                self.deliver(message["channel"][len(self.prefix):], message["data"])
+
+
+def create_broadcaster() -> Broadcaster:
+    options = {
+        "queue_size": settings.ws_send_queue_size,
+        "send_timeout": settings.ws_send_timeout_seconds,
+        "ping_interval": settings.ws_ping_interval_seconds,
+        "idle_timeout": settings.ws_idle_timeout_seconds,
+    }
+    if settings.broadcast_backend == "redis":
+        return RedisBroadcaster(prefix=f"{settings.app_name}:ws:", **options)
+    if settings.broadcast_backend != "memory":
+        raise ValueError(f"Unknown broadcast backend: {settings.broadcast_backend}")
+    return Broadcaster(**options)
+
+
+broadcaster = create_broadcaster()
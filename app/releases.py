@@ -0,0 +1,428 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from fastapi import HTTPException, status
+from fastapi.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+from .config import settings
+
+try:
+    import bsdiff4
+except ImportError:  # deltas are an optimization; full packages are always served
+    bsdiff4 = None
+
+logger = logging.getLogger(__name__)
+
+RELEASES_DIR = Path(__file__).parent.parent / "updates" / "releases"
+PATCHES_DIR = Path(__file__).parent.parent / "updates" / "patches"
+FALLBACK_VERSION = "0.3.3"
+
+_FILENAME = re.compile(r"^notes-desktop_(\d+)\.(\d+)\.(\d+)_([^-]+)-pc-([^-]+)-msvc\.msi\.zip$")
+_PATCH_FILENAME = re.compile(
+    r"^notes-desktop_(\d+\.\d+\.\d+)_to_(\d+\.\d+\.\d+)_([^-]+)-pc-([^-]+)-msvc\.msi\.zip\.bsdiff$"
+)
+# a patch lock or partial file this old was left by a writer that died
+_STALE_SECONDS = 3600
+
+
+def parse_version(value: str) -> tuple:
+    try:
+        return tuple(map(int, value.split(".")))
+    except ValueError:
+        return (0, 0, 0)
+
+
+def etag_for(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+class Release:
+    """One full update package in the releases directory."""
+
+    media_type = "application/zip"
+
+    def __init__(self, path: Path, version: tuple, target: str, arch: str, stat: os.stat_result):
+        self.path = path
+        self.filename = path.name
+        self.version = version
+        self.version_str = ".".join(map(str, version))
+        self.target = target
+        self.arch = arch
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.stat = stat
+        self.etag: Optional[str] = None  # strong, from the content hash; see ReleaseIndex.content_etag
+
+    @property
+    def download_url(self) -> str:
+        return f"{settings.update_base_url}/api/updates/download/{self.filename}"
+
+
+class Patch(Release):
+    """bsdiff patch turning the package of from_version into the package of version."""
+
+    media_type = "application/octet-stream"
+
+    def __init__(self, path: Path, from_version: tuple, version: tuple, target: str, arch: str, stat: os.stat_result):
+        super().__init__(path, version, target, arch, stat)
+        self.from_version = from_version
+
+
+def patch_filename(old: Release, new: Release) -> str:
+    return f"notes-desktop_{old.version_str}_to_{new.version_str}_{new.arch}-pc-{new.target}-msvc.msi.zip.bsdiff"
+
+
+class Manifest:
+    """
+    Precomputed update check answers for one (target, arch): the full
+    package, plus one variant per installed version that has a patch to the
+    latest. Patched answers keep "url" pointing at the full package as the
+    fallback and describe the patch under "delta".
+    """
+
+    def __init__(self, latest: Release, patches: list[Patch]):
+        self.latest = latest
+        self.body, self.etag = self._render()
+        self.deltas = {patch.from_version: self._render(patch) for patch in patches}
+
+    def answer(self, current_version: tuple) -> tuple[bytes, str]:
+        return self.deltas.get(current_version) or (self.body, self.etag)
+
+    def _render(self, patch: Optional[Patch] = None) -> tuple[bytes, str]:
+        data = {
+            "url": self.latest.download_url,
+            "version": self.latest.version_str,
+            "notes": "Nowa wersja zawiera poprawki i ulepszenia",
+            "pub_date": datetime.utcfromtimestamp(self.latest.mtime).isoformat() + "Z",
+            "signature": "",
+        }
+        if patch is not None:
+            data["delta"] = {
+                "url": patch.download_url,
+                "from_version": ".".join(map(str, patch.from_version)),
+                "format": "bsdiff40",
+                "size": patch.size,
+                "full_size": self.latest.size,
+            }
+        body = json.dumps(data).encode()
+        return body, etag_for(body)
+
+
+class ReleaseIndex:
+    """
+    In-memory index of updates/releases/ (and updates/patches/) for the
+    updater endpoints.
+
+    Responses are built once per scan and served as bytes with an ETag.
+    The directories' mtimes are checked at most every refresh_seconds, and
+    they are rescanned only when they changed (a file was added, removed or
+    renamed), so steady-state polling does no filesystem I/O at all.
+
+    When bsdiff4 is installed, patches from each of the delta_versions
+    previous versions to the latest one are generated in a background
+    thread after a scan finds them missing; they show up in check_update
+    answers once written. Patches not smaller than delta_max_ratio of the
+    full package are not worth it and are not offered.
+    """
+
+    def __init__(self, directory: Path, patches_directory: Path, refresh_seconds: float, delta_versions: int, delta_max_ratio: float):
+        self.directory = directory
+        self.patches_directory = patches_directory
+        self.refresh_seconds = refresh_seconds
+        self.delta_versions = delta_versions if bsdiff4 is not None else 0
+        self.delta_max_ratio = delta_max_ratio
+        self.releases: list[Release] = []
+        self.patches: list[Patch] = []
+        self._generating = False
+        self.manifests: dict[tuple[str, str], Manifest] = {}
+        self.version_info: bytes = b""
+        self.version_info_etag = ""
+        self._mtime_ns: Optional[tuple] = None
+        self._checked_at = float("-inf")
+        self._by_name: dict[str, Release] = {}
+        # content hashes survive rescans as long as the file is unchanged
+        self._hashes: dict[tuple[str, int, int], str] = {}
+        self._hashing: dict[tuple[str, int, int], asyncio.Future] = {}
+        self.scans = 0
+
+    def refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh_seconds:
+            return
+        self._checked_at = now
+        mtime_ns = (_mtime_ns(self.directory), _mtime_ns(self.patches_directory))
+        if mtime_ns == self._mtime_ns and not force:
+            return
+        self._scan()
+        self._mtime_ns = mtime_ns
+
+    def manifest(self, target: str, arch: str) -> Optional[Manifest]:
+        self.refresh()
+        return self.manifests.get((target, arch))
+
+    def get(self, filename: str) -> Optional[Release]:
+        self.refresh()
+        return self._by_name.get(filename)
+
+    async def content_etag(self, release: Release) -> str:
+        """Strong ETag from the SHA-256 of the package, hashed off the event loop once per file version."""
+        if release.etag is None:
+            key = (release.filename, release.size, release.stat.st_mtime_ns)
+            digest = self._hashes.get(key)
+            if digest is None:
+                future = self._hashing.get(key)
+                if future is None:
+                    future = asyncio.ensure_future(asyncio.to_thread(_sha256, release.path))
+                    self._hashing[key] = future
+                try:
+                    digest = await asyncio.shield(future)
+                finally:
+                    self._hashing.pop(key, None)
+                self._hashes[key] = digest
+            release.etag = f'"{digest}"'
+        return release.etag
+
+    def _scan(self) -> None:
+        releases = []
+        if self.directory.is_dir():
+            for entry in os.scandir(self.directory):
+                match = _FILENAME.match(entry.name)
+                if match and entry.is_file():
+                    major, minor, patch, arch, target = match.groups()
+                    version = (int(major), int(minor), int(patch))
+                    releases.append(Release(Path(entry.path), version, target, arch, entry.stat()))
+        releases.sort(key=lambda release: release.version)
+        history: dict[tuple[str, str], list[Release]] = {}
+        for release in releases:
+            history.setdefault((release.target, release.arch), []).append(release)
+
+        wanted: dict[str, tuple[Release, Release]] = {}
+        for versions in history.values():
+            latest = versions[-1]
+            for old in versions[-1 - self.delta_versions : -1] if self.delta_versions else []:
+                wanted[patch_filename(old, latest)] = (old, latest)
+
+        patches = []
+        if self.patches_directory.is_dir():
+            for entry in os.scandir(self.patches_directory):
+                match = _PATCH_FILENAME.match(entry.name)
+                if match and entry.name in wanted and entry.is_file():
+                    old, latest = wanted[entry.name]
+                    patch = Patch(Path(entry.path), old.version, latest.version, latest.target, latest.arch, entry.stat())
+                    if patch.size < latest.size * self.delta_max_ratio:
+                        patches.append(patch)
+        # a patch counts as present even if too large to offer, so it is not regenerated
+        missing = [pair for name, pair in wanted.items() if not (self.patches_directory / name).exists()]
+
+        self.releases = releases
+        self.patches = patches
+        files = [*releases, *patches]
+        live = {(release.filename, release.size, release.stat.st_mtime_ns) for release in files}
+        self._hashes = {key: digest for key, digest in self._hashes.items() if key in live}
+        self._by_name = {release.filename: release for release in files}
+        self.manifests = {
+            key: Manifest(versions[-1], [patch for patch in patches if (patch.target, patch.arch) == key])
+            for key, versions in history.items()
+        }
+        if releases:
+            newest = releases[-1]
+            info = {"latest_version": newest.version_str, "download_url": newest.download_url, "current_file": newest.filename}
+        else:
+            info = {"latest_version": FALLBACK_VERSION, "download_url": None}
+        self.version_info = json.dumps(info).encode()
+        self.version_info_etag = etag_for(self.version_info)
+        self.scans += 1
+        logger.info("Indexed %d update packages and %d patches", len(releases), len(patches))
+        if missing and not self._generating:
+            self._generating = True
+            asyncio.get_running_loop().run_in_executor(None, self._generate, missing, set(wanted))
+
+    def _generate(self, pairs: list[tuple[Release, Release]], wanted: set[str]) -> None:
+        """
+        Write missing patches and drop ones no longer wanted (runs in a worker thread).
+
+        Every worker process scans the same directory, so each patch is
+        written by whichever one creates its .lock file first, into a
+        partial file of its own, and only appears under its final name,
+        complete, by an atomic rename. Other workers skip it and index it
+        once the rename changes the directory.
+        """
+        try:
+            self.patches_directory.mkdir(parents=True, exist_ok=True)
+            for old, new in pairs:
+                target = self.patches_directory / patch_filename(old, new)
+                lock = target.with_name(target.name + ".lock")
+                if not _lock_exclusive(lock):
+                    continue
+                partial = target.with_name(f"{target.name}.{os.getpid()}.partial")
+                try:
+                    if target.exists():
+                        continue
+                    started = time.monotonic()
+                    bsdiff4.file_diff(str(old.path), str(new.path), str(partial))
+                    partial.replace(target)
+                    logger.info(
+                        "Generated %s (%d bytes) in %.1fs", target.name, target.stat().st_size, time.monotonic() - started
+                    )
+                finally:
+                    partial.unlink(missing_ok=True)
+                    lock.unlink(missing_ok=True)
+            for entry in os.scandir(self.patches_directory):
+                if _PATCH_FILENAME.match(entry.name) and entry.name not in wanted:
+                    os.unlink(entry.path)
+                elif entry.name.endswith(".partial") and time.time() - entry.stat().st_mtime > _STALE_SECONDS:
+                    os.unlink(entry.path)
+        except Exception:
+            logger.exception("Generating update patches failed")
+        finally:
+            self._generating = False
+
+    def stats(self) -> dict:
+        return {"releases": len(self.releases), "patches": len(self.patches), "scans": self.scans}
+
+
+def _lock_exclusive(path: Path) -> bool:
+    """Create path if it does not exist; a stale one is taken over."""
+    for _ in range(2):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - path.stat().st_mtime < _STALE_SECONDS:
+                    return False
+                path.unlink()
+            except FileNotFoundError:
+                pass
+    return False
+
+
+def _mtime_ns(directory: Path) -> Optional[int]:
+    try:
+        return directory.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadLimiter:
+    """
+    Caps concurrent package downloads per client and in total, and the
+    bandwidth each client gets, so that a release rollout cannot tie up the
+    worker serving notes traffic. Over the limit callers get 503 with
+    Retry-After, which the updater treats as "try again later".
+    """
+
+    def __init__(self, max_per_client: int, max_total: int, client_rate: int):
+        self.max_per_client = max_per_client
+        self.max_total = max_total
+        self.client_rate = client_rate  # bytes per second per client, 0 = unlimited
+        self.active: dict[str, int] = {}
+        self.total = 0
+        self.rejected = 0
+        self.bytes_sent = 0
+
+    def acquire(self, client: str) -> None:
+        if self.total >= self.max_total or self.active.get(client, 0) >= self.max_per_client:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent downloads, try again",
+                headers={"Retry-After": "10"},
+            )
+        self.active[client] = self.active.get(client, 0) + 1
+        self.total += 1
+
+    def release(self, client: str) -> None:
+        self.total -= 1
+        remaining = self.active[client] - 1
+        if remaining:
+            self.active[client] = remaining
+        else:
+            del self.active[client]
+
+    def throttled(self, client: str, send: Send) -> Send:
+        """Wrap send so body chunks go out at no more than the client's share of client_rate."""
+        started = time.monotonic()
+        sent = 0
+
+        async def throttled_send(message) -> None:
+            nonlocal sent
+            await send(message)
+            if message["type"] != "http.response.body":
+                return
+            sent += len(message.get("body", b""))
+            self.bytes_sent += len(message.get("body", b""))
+            if self.client_rate:
+                rate = self.client_rate / max(self.active.get(client, 1), 1)
+                delay = sent / rate - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+        return throttled_send
+
+    def stats(self) -> dict:
+        return {"active": self.total, "clients": len(self.active), "rejected": self.rejected, "bytes_sent": self.bytes_sent}
+
+
+class ReleaseFileResponse(FileResponse):
+    """
+    FileResponse for an update package: strong content-hash ETag (also used
+    to validate If-Range, so a resumed download never splices two builds),
+    larger read chunks, and a DownloadLimiter slot held for the whole
+    transfer. Range requests themselves are handled by FileResponse.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(self, release: Release, etag: str, limiter: DownloadLimiter, client: str):
+        super().__init__(
+            release.path,
+            media_type=release.media_type,
+            filename=release.filename,
+            stat_result=release.stat,
+            headers={"ETag": etag, "Cache-Control": "public, max-age=86400, immutable"},
+        )
+        self.etag = etag
+        self.limiter = limiter
+        self.client = client
+
+    def _should_use_range(self, http_if_range: str, stat_result: os.stat_result) -> bool:
+        return http_if_range == self.etag or super()._should_use_range(http_if_range, stat_result)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.limiter.acquire(self.client)
+        try:
+            await super().__call__(scope, receive, self.limiter.throttled(self.client, send))
+        finally:
+            self.limiter.release(self.client)
+
+
+release_index = ReleaseIndex(
+    RELEASES_DIR,
+    PATCHES_DIR,
+    refresh_seconds=settings.update_refresh_seconds,
+    delta_versions=settings.update_delta_versions,
+    delta_max_ratio=settings.update_delta_max_ratio,
+)
+download_limiter = DownloadLimiter(
+    max_per_client=settings.update_download_max_per_client,
+    max_total=settings.update_download_max_total,
+    client_rate=settings.update_download_client_rate,
+)
@@ -0,0 +1,354 @@
+import asyncio
+import heapq
+import logging
+import secrets
+from datetime import datetime, time, timedelta, timezone
+from typing import Iterable, Optional
+from uuid import UUID
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import delete, inspect, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import get_redis
+from .config import settings
+from .database import AsyncSessionLocal
+from .models import CalendarEvent, Reminder, User, utcnow
+from .realtime import broadcaster, calendar_channel
+from .serialization import dumps_text
+
+logger = logging.getLogger(__name__)
+
+# compare-and-set on the leader lock, so a process never extends or releases a lock it lost
+_RENEW = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0"
+_RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+# fields that determine an event's reminders
+_TIMING_FIELDS = ("start_time", "is_all_day", "event_date", "reminder_minutes")
+
+
+def parse_reminder_minutes(value: Optional[str]) -> list[int]:
+    """ "15,60" -> [15, 60]; blanks, duplicates and non-numeric entries are ignored."""
+    minutes = set()
+    for part in (value or "").split(","):
+        part = part.strip()
+        if part.isdigit():
+            minutes.add(int(part))
+    return sorted(minutes)
+
+
+def event_start(event: CalendarEvent) -> Optional[datetime]:
+    """Start as a wall-clock time in the owner's zone, as the client sent it."""
+    if event.is_all_day:
+        if event.event_date is None:
+            return None
+        return datetime.combine(event.event_date, time(hour=settings.reminder_all_day_hour))
+    return event.start_time
+
+
+def local_to_utc(value: datetime, zone: str) -> datetime:
+    """A wall-clock time in zone as naive UTC, comparable with utcnow()."""
+    return value.replace(tzinfo=ZoneInfo(zone)).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+async def schedule_reminders(
+    session: AsyncSession, events: list[CalendarEvent], timezones: Optional[dict[UUID, str]] = None, force: bool = False
+) -> list[datetime]:
+    """
+    Replace the pending reminders of events with ones computed from their
+    current fields, in the caller's transaction. Events whose timing and
+    reminder fields are unchanged are left alone unless force is set, and
+    reminders already in the past are skipped. Returns the new fire times,
+    to be passed to ReminderScheduler.notify after commit.
+
+    Event times are read in their owner's time zone: timezones maps owner
+    ids to zone names, and owners missing from it are looked up.
+    """
+    changed, stale = [], []
+    for event in events:
+        state = inspect(event)
+        if state.pending:
+            if parse_reminder_minutes(event.reminder_minutes):
+                changed.append(event)
+        elif force or any(state.attrs[name].history.has_changes() for name in _TIMING_FIELDS):
+            changed.append(event)
+            stale.append(event.id)
+    if not changed:
+        return []
+    await session.flush()  # assigns ids to new events and orders their INSERTs first
+    if stale:
+        await session.execute(delete(Reminder).where(Reminder.event_id.in_(stale)))
+    timezones = dict(timezones or {})
+    missing = {event.owner_id for event in changed} - timezones.keys()
+    if missing:
+        result = await session.execute(select(User.id, User.timezone).where(User.id.in_(missing)))
+        timezones.update(result.tuples())
+    now = utcnow()
+    fire_times = []
+    for event in changed:
+        start = event_start(event)
+        if start is None:
+            continue
+        start = local_to_utc(start, timezones.get(event.owner_id, settings.default_timezone))
+        for minutes in parse_reminder_minutes(event.reminder_minutes):
+            fire_at = start - timedelta(minutes=minutes)
+            if fire_at > now:
+                session.add(Reminder(event_id=event.id, owner_id=event.owner_id, minutes=minutes, fire_at=fire_at))
+                fire_times.append(fire_at)
+    return fire_times
+
+
+def reminder_message(event: CalendarEvent, minutes: int, fire_at: datetime) -> str:
+    return dumps_text(
+        {
+            "type": "reminder",
+            "event_id": event.id,
+            "title": event.title,
+            "minutes": minutes,
+            "fire_at": fire_at.replace(tzinfo=timezone.utc),
+            "start": event_start(event),  # local, like the event's own fields
+            "is_all_day": event.is_all_day,
+        }
+    )
+
+
+class ReminderScheduler:
+    """
+    Sends due reminders as "reminder" messages on the owner's calendar channel.
+
+    Pending reminders live in the reminders table, indexed by fire_at. Only
+    the leader process sends them: it keeps the fire times due within the
+    next horizon_seconds in a min-heap and sleeps until the earliest one, or
+    until notify() reports an earlier one. Due rows are claimed with
+    DELETE ... RETURNING, so each reminder is sent once even if leadership
+    changes hands. Heap entries are only wake-up times; a reminder that was
+    changed or deleted after being loaded just causes an empty wake-up.
+
+    With the redis broadcast backend the leader holds a Redis lock that it
+    keeps renewing, and other workers forward new fire times to it over
+    pub/sub. With the memory backend the single process is always the leader.
+    """
+
+    def __init__(self, horizon: float, batch_size: int, grace: float, lock_ttl: float, distributed: bool):
+        self.horizon = timedelta(seconds=horizon)
+        self.batch_size = batch_size
+        self.grace = timedelta(seconds=grace)
+        self.lock_ttl = lock_ttl
+        self.distributed = distributed
+        self.leader = False
+        self._key = f"{settings.app_name}:reminders:leader"
+        self._wake_channel = f"{settings.app_name}:reminders:wake"
+        self._token = secrets.token_hex(16)
+        self._heap: list[datetime] = []
+        self._loaded_until: Optional[datetime] = None
+        self._wake = asyncio.Event()
+        self._pubsub = None
+        self._tasks: list[asyncio.Task] = []
+        self.sent = 0
+        self.expired = 0
+
+    async def start(self) -> None:
+        self._tasks.append(asyncio.create_task(self._run()))
+        if self.distributed:
+            self._pubsub = get_redis().pubsub()
+            await self._pubsub.subscribe(self._wake_channel)
+            self._tasks.append(asyncio.create_task(self._listen()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        if self.distributed and self.leader:
+            try:
+                await get_redis().eval(_RELEASE, 1, self._key, self._token)
+            except Exception:
+                logger.warning("Failed to release reminder leader lock", exc_info=True)
+        self.leader = False
+
+    async def notify(self, fire_times: Iterable[datetime]) -> None:
+        """Make the leader wake up for reminders just scheduled (after commit)."""
+        fire_times = list(fire_times)
+        if not fire_times:
+            return
+        self._add(fire_times)
+        if self.distributed:
+            try:
+                await get_redis().publish(self._wake_channel, ",".join(t.isoformat() for t in fire_times))
+            except Exception:
+                logger.warning("Redis publish failed, reminders may be sent late", exc_info=True)
+
+    def stats(self) -> dict:
+        return {
+            "leader": self.leader,
+            "scheduled": len(self._heap),
+            "next": self._heap[0].isoformat() if self._heap else None,
+            "sent": self.sent,
+            "expired": self.expired,
+        }
+
+    def _add(self, fire_times: list[datetime]) -> None:
+        if self._loaded_until is None:
+            return
+        earliest = self._heap[0] if self._heap else None
+        for fire_at in fire_times:
+            if fire_at <= self._loaded_until:
+                heapq.heappush(self._heap, fire_at)
+        if self._heap and self._heap[0] != earliest:
+            self._wake.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if not await self._elect():
+                    await asyncio.sleep(self.lock_ttl / 3)
+                    continue
+                await self._send_due()
+                if self._loaded_until is None or utcnow() >= self._loaded_until:
+                    await self._load()
+                await self._sleep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Reminder scheduler iteration failed", exc_info=True)
+                await asyncio.sleep(1.0)
+
+    async def _elect(self) -> bool:
+        if not self.distributed:
+            if not self.leader:
+                await self._backfill()
+                self.leader = True
+            return True
+        redis = get_redis()
+        ttl_ms = int(self.lock_ttl * 1000)
+        if self.leader and await redis.eval(_RENEW, 1, self._key, self._token, ttl_ms):
+            return True
+        acquired = bool(await redis.set(self._key, self._token, nx=True, px=ttl_ms))
+        if acquired and not self.leader:
+            logger.info("Became reminder scheduler leader")
+            self._loaded_until = None
+            await self._backfill()
+        elif not acquired and self.leader:
+            logger.info("Lost reminder scheduler leadership")
+            self._heap.clear()
+            self._loaded_until = None
+        self.leader = acquired
+        return acquired
+
+    async def _sleep(self) -> None:
+        deadline = self._loaded_until
+        if self._heap:
+            deadline = min(deadline, self._heap[0])
+        timeout = (deadline - utcnow()).total_seconds()
+        if self.distributed:
+            timeout = min(timeout, self.lock_ttl / 3)
+        self._wake.clear()
+        if timeout > 0:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _load(self) -> None:
+        now = utcnow()
+        until = now + self.horizon
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Reminder.fire_at)
+                .where((Reminder.fire_at > now) & (Reminder.fire_at <= until))
+                .order_by(Reminder.fire_at)
+                .limit(self.batch_size)
+            )
+            fire_times = list(result.scalars())
+        self._heap = fire_times  # already sorted, hence a valid heap
+        self._loaded_until = fire_times[-1] if len(fire_times) == self.batch_size else until
+
+    async def _send_due(self) -> None:
+        now = utcnow()
+        while self._heap and self._heap[0] <= now:
+            heapq.heappop(self._heap)
+        while True:
+            async with AsyncSessionLocal() as session:
+                due = (
+                    select(Reminder.id)
+                    .where(Reminder.fire_at <= now)
+                    .order_by(Reminder.fire_at)
+                    .limit(self.batch_size)
+                    .with_for_update(skip_locked=True)
+                )
+                result = await session.execute(
+                    delete(Reminder)
+                    .where(Reminder.id.in_(due))
+                    .returning(Reminder.event_id, Reminder.owner_id, Reminder.minutes, Reminder.fire_at)
+                )
+                rows = result.all()
+                events = {}
+                if rows:
+                    result = await session.execute(
+                        select(CalendarEvent).where(CalendarEvent.id.in_({row.event_id for row in rows}))
+                    )
+                    events = {event.id: event for event in result.scalars()}
+                await session.commit()
+            for row in rows:
+                event = events.get(row.event_id)
+                if event is None:
+                    continue
+                if row.fire_at < now - self.grace:
+                    self.expired += 1
+                    continue
+                await broadcaster.publish(calendar_channel(row.owner_id), reminder_message(event, row.minutes, row.fire_at))
+                self.sent += 1
+            if len(rows) < self.batch_size:
+                return
+
+    async def _backfill(self) -> None:
+        """
+        Schedule the events not yet reflected in the reminders table (created
+        before it existed), batch_size at a time in id order, committing each
+        batch with the events marked, so every event is scanned once however
+        often leadership changes hands.
+        """
+        after = None
+        while True:
+            query = select(CalendarEvent).where(~CalendarEvent.reminders_scheduled)
+            if after is not None:
+                query = query.where(CalendarEvent.id > after)
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(query.order_by(CalendarEvent.id).limit(self.batch_size))
+                events = list(result.scalars())
+                if not events:
+                    return
+                await schedule_reminders(session, events, force=True)
+                await session.execute(
+                    update(CalendarEvent)
+                    .where(CalendarEvent.id.in_([event.id for event in events]))
+                    # not a change of the event: keep updated_at, which drives /sync
+                    .values(reminders_scheduled=True, updated_at=CalendarEvent.updated_at)
+                )
+                await session.commit()
+            after = events[-1].id
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Redis pub/sub receive failed", exc_info=True)
+                await asyncio.sleep(1.0)
+                continue
+            if message and message["type"] == "message" and self.leader:
+                self._add([datetime.fromisoformat(value) for value in message["data"].split(",")])
+
+
+reminder_scheduler = ReminderScheduler(
+    horizon=settings.reminder_horizon_seconds,
+    batch_size=settings.reminder_batch_size,
+    grace=settings.reminder_grace_seconds,
+    lock_ttl=settings.reminder_lock_ttl_seconds,
+    distributed=settings.broadcast_backend == "redis",
+)
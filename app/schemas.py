@@ -1,18 +1,36 @@
 from datetime import datetime, timedelta, date
-from typing import Optional
+from typing import Annotated, Literal, Optional, Union
 from uuid import UUID
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-from pydantic import BaseModel, Field
+from pydantic import AfterValidator, BaseModel, Field
+
+
+def _known_timezone(name: str) -> str:
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone: {name}")
+    return name
+
+
+TimeZoneName = Annotated[str, Field(max_length=64), AfterValidator(_known_timezone)]  # IANA, e.g. "Europe/Warsaw"
 
 
 class UserCreate(BaseModel):
     username: str = Field(min_length=3, max_length=150)
     password: str = Field(min_length=6)
+    timezone: Optional[TimeZoneName] = None
+
+
+class UserUpdate(BaseModel):
+    timezone: TimeZoneName
 
 
 class UserOut(BaseModel):
     id: UUID
     username: str
+    timezone: str
     created_at: datetime
 
     class Config:
@@ -51,6 +69,7 @@ class NoteOut(BaseModel):
     color: Optional[str] = None
     tags: Optional[str] = None
     archived: bool = False
+    revision: int = 0
     updated_at: datetime
 
     class Config:
@@ -90,3 +109,74 @@ class CalendarEventOut(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class NoteBatchCreate(BaseModel):
+    op: Literal["create"]
+    data: NoteCreate
+
+
+class NoteBatchUpdate(BaseModel):
+    op: Literal["update"]
+    id: UUID
+    data: NoteUpdate
+
+
+class NoteBatchDelete(BaseModel):
+    op: Literal["delete"]
+    id: UUID
+
+
+class NoteBatchRequest(BaseModel):
+    ops: list[Annotated[Union[NoteBatchCreate, NoteBatchUpdate, NoteBatchDelete], Field(discriminator="op")]] = Field(
+        min_length=1, max_length=500
+    )
+
+
+class NoteBatchResult(BaseModel):
+    index: int
+    status: int  # 201 created, 200 updated, 204 deleted, 404 not found
+    id: Optional[UUID] = None
+    note: Optional[NoteOut] = None
+    error: Optional[str] = None
+
+
+class CalendarEventBatchCreate(BaseModel):
+    op: Literal["create"]
+    data: CalendarEventCreate
+
+
+class CalendarEventBatchUpdate(BaseModel):
+    op: Literal["update"]
+    id: UUID
+    data: CalendarEventUpdate
+
+
+class CalendarEventBatchDelete(BaseModel):
+    op: Literal["delete"]
+    id: UUID
+
+
+class CalendarEventBatchRequest(BaseModel):
+    ops: list[
+        Annotated[
+            Union[CalendarEventBatchCreate, CalendarEventBatchUpdate, CalendarEventBatchDelete], Field(discriminator="op")
+        ]
+    ] = Field(min_length=1, max_length=500)
+
+
+class CalendarEventBatchResult(BaseModel):
+    index: int
+    status: int
+    id: Optional[UUID] = None
+    event: Optional[CalendarEventOut] = None
+    error: Optional[str] = None
+
+
+class SyncOut(BaseModel):
+    notes: list[NoteOut]
+    events: list[CalendarEventOut]
+    deleted_notes: list[UUID]
+    deleted_events: list[UUID]
+    token: str
+    full: bool = False  # True when the client must replace, not merge, its local state
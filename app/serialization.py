@@ -0,0 +1,66 @@
+"""
+JSON for list responses and WebSocket messages, built straight from rows.
+
+Rows loaded from the database already have the types the *Out schemas
+declare, so list endpoints and broadcasts skip pydantic (a model instance
+and a validation pass per row) and encode plain dicts of column values.
+orjson is used when installed; the stdlib fallback produces the same JSON.
+"""
+import json
+from datetime import date, datetime
+from typing import Any, Iterable, Optional
+from uuid import UUID
+
+from fastapi.responses import JSONResponse
+
+from .schemas import CalendarEventOut, NoteOut
+
+try:
+    import orjson
+except ImportError:  # the stdlib encoder is slower but equivalent
+    orjson = None
+
+NOTE_FIELDS = tuple(NoteOut.model_fields)
+EVENT_FIELDS = tuple(CalendarEventOut.model_fields)
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        # asyncpg returns its own UUID subclass, which orjson leaves to default
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def dumps_text(content: Any) -> str:
+    """dumps() for WebSocket text frames."""
+    return dumps(content).decode()
+
+
+def row_dict(row, fields: Iterable[str]) -> dict:
+    """The given fields of an ORM instance or a projected result row."""
+    # loaded column values of an ORM instance sit in its __dict__; reading
+    # them there skips the instrumented attribute, which costs more per row
+    # than encoding the result
+    loaded = getattr(row, "__dict__", {})
+    return {field: loaded[field] if field in loaded else getattr(row, field) for field in fields}
+
+
+def note_dict(note, fields: Optional[Iterable[str]] = None) -> dict:
+    return row_dict(note, NOTE_FIELDS if fields is None else fields)
+
+
+def event_dict(event, fields: Optional[Iterable[str]] = None) -> dict:
+    return row_dict(event, EVENT_FIELDS if fields is None else fields)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
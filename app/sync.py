@@ -0,0 +1,118 @@
+import asyncio
+import base64
+import logging
+from datetime import datetime, timedelta
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .database import AsyncSessionLocal
+from .models import CalendarEvent, CollectionVersion, Note, Tombstone
+
+NOTE = "note"
+EVENT = "event"
+
+logger = logging.getLogger(__name__)
+
+
+def encode_sync_token(watermark: datetime) -> str:
+    return base64.urlsafe_b64encode(watermark.isoformat().encode()).decode().rstrip("=")
+
+
+def decode_sync_token(token: str) -> datetime:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        return datetime.fromisoformat(base64.urlsafe_b64decode(padded).decode())
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+
+def record_deletion(session: AsyncSession, entity_type: str, entity_id: UUID, owner_id: UUID) -> None:
+    """Add a tombstone to the session; it commits together with the delete."""
+    session.add(Tombstone(entity_type=entity_type, entity_id=entity_id, owner_id=owner_id))
+
+
+async def bump_version(session: AsyncSession, collection: str, owner_id: UUID) -> None:
+    """
+    Count a change to owner_id's notes or events; it commits together with
+    the change. Call it last before the commit: the counter row stays locked
+    until then, serializing the owner's concurrent writes to the collection.
+    Pending changes are flushed first, so every transaction locks the
+    changed rows before the counter row and lock order cannot invert.
+    """
+    await session.flush()
+    stmt = insert(CollectionVersion).values(owner_id=owner_id, collection=collection, version=1)
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[CollectionVersion.owner_id, CollectionVersion.collection],
+            set_={"version": CollectionVersion.version + 1},
+        )
+    )
+
+
+async def collection_version(session: AsyncSession, collection: str, owner_id: UUID) -> int:
+    result = await session.execute(
+        select(CollectionVersion.version).where(
+            (CollectionVersion.owner_id == owner_id) & (CollectionVersion.collection == collection)
+        )
+    )
+    return result.scalar_one_or_none() or 0
+
+
+async def prune_tombstones(session: AsyncSession) -> None:
+    horizon = datetime.utcnow() - timedelta(days=settings.sync_tombstone_retention_days)
+    await session.execute(delete(Tombstone).where(Tombstone.deleted_at < horizon))
+    await session.commit()
+
+
+async def prune_tombstones_periodically() -> None:
+    """Prune on startup and then every sync_prune_interval_seconds, until cancelled."""
+    while True:
+        try:
+            async with AsyncSessionLocal() as session:
+                await prune_tombstones(session)
+        except Exception:
+            logger.warning("Tombstone pruning failed", exc_info=True)
+        await asyncio.sleep(settings.sync_prune_interval_seconds)
+
+
+async def changes_since(session: AsyncSession, owner_id: UUID, token: str | None) -> dict:
+    """
+    Notes and events of owner_id changed after the token's watermark, plus
+    tombstones of the ones deleted since. Without a token, or with one older
+    than the tombstone retention period, returns a full snapshot instead.
+
+    The returned token trails the current time by sync_overlap_seconds so
+    that rows whose transaction started before this call but committed after
+    it are picked up by the next sync; clients may see such rows twice.
+    """
+    now = datetime.utcnow()
+    since = decode_sync_token(token) if token else None
+    full = since is None or since < now - timedelta(days=settings.sync_tombstone_retention_days)
+
+    notes = select(Note).where(Note.owner_id == owner_id)
+    events = select(CalendarEvent).where(CalendarEvent.owner_id == owner_id)
+    deleted: dict[str, list[UUID]] = {NOTE: [], EVENT: []}
+    if not full:
+        notes = notes.where(Note.updated_at > since)
+        events = events.where(CalendarEvent.updated_at > since)
+        result = await session.execute(
+            select(Tombstone.entity_type, Tombstone.entity_id).where(
+                (Tombstone.owner_id == owner_id) & (Tombstone.deleted_at > since)
+            )
+        )
+        for entity_type, entity_id in result.all():
+            deleted[entity_type].append(entity_id)
+
+    return {
+        "notes": (await session.execute(notes)).scalars().all(),
+        "events": (await session.execute(events)).scalars().all(),
+        "deleted_notes": deleted[NOTE],
+        "deleted_events": deleted[EVENT],
+        "token": encode_sync_token(now - timedelta(seconds=settings.sync_overlap_seconds)),
+        "full": full,
+    }
@@ -0,0 +1,402 @@
+"""
+Load test of a running API server over HTTP and WebSockets.
+
+Start the server against the database and Redis you want to measure, e.g.
+
+    uvicorn app.main:app --port 8000
+
+then run one or more scenarios against it:
+
+    python -m bench.load --url http://127.0.0.1:8000 --scenario all
+
+Scenarios:
+    auth      register + login of --users users, --concurrency at a time
+    crud      create, get, patch and delete notes, --ops per user
+    list      seed --notes notes for one user, then page through GET /notes,
+              fetch the unpaginated list, and revalidate it with If-None-Match
+    ws-notes  --sockets clients on /ws/notes/{id} (spread over --channels notes);
+              REST PATCHes are timed until every subscriber has the update
+    ws-calendar  --sockets clients on /ws/calendar of one user; event creates
+              are timed until every socket has the "calendar" message
+    ws-mux    --sockets clients on the multiplexed /ws, each subscribed to all
+              --channels notes and the calendar (what ws-notes plus
+              ws-calendar take --channels + 1 sockets per client for);
+              note PATCHes and event creates alternate
+    ws-idle   the crud scenario while --sockets idle note/calendar sockets are
+              open; with more sockets than pooled database connections, REST
+              calls must still succeed
+
+Each scenario prints throughput and p50/p99 latency; WebSocket scenarios
+also print broadcast delivery latency (request sent -> message received
+by a subscriber) and server memory per connection, read from the
+process_resident_memory_bytes gauge of /metrics (run the server with a
+single worker for that number to mean anything).
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+import httpx
+import websockets
+
+PASSWORD = "bench-password"
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summary(name: str, latencies: list[float], elapsed: float, errors: int = 0) -> dict:
+    return {
+        "name": name,
+        "count": len(latencies),
+        "errors": errors,
+        "per s": len(latencies) / elapsed if elapsed else 0.0,
+        "p50 ms": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "p99 ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def report(rows: list[dict]) -> None:
+    keys = ["count", "errors", "per s", "p50 ms", "p99 ms"]
+    print(f"{'':32}" + "".join(f"{k:>12}" for k in keys))
+    for row in rows:
+        print(f"{row['name']:32}" + "".join(f"{row[k]:>12.1f}" for k in keys))
+
+
+async def timed(fn, latencies: list[float], failures: list[int]):
+    started = time.perf_counter()
+    try:
+        response = await fn()
+        if response.status_code != 304:  # a revalidated, unchanged response
+            response.raise_for_status()
+    except httpx.HTTPError:
+        failures.append(1)
+        return None
+    latencies.append(time.perf_counter() - started)
+    return response
+
+
+async def run_concurrently(jobs, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(job):
+        async with semaphore:
+            await job()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(job) for job in jobs))
+    return time.perf_counter() - started
+
+
+async def new_user(client: httpx.AsyncClient) -> tuple[str, dict]:
+    username = f"bench-{uuid.uuid4().hex[:12]}"
+    (await client.post("/auth/register", json={"username": username, "password": PASSWORD})).raise_for_status()
+    response = await client.post("/auth/login", data={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+    token = response.json()["access_token"]
+    return token, {"Authorization": f"Bearer {token}"}
+
+
+async def server_memory(client: httpx.AsyncClient) -> float:
+    for line in (await client.get("/metrics")).text.splitlines():
+        if line.startswith("process_resident_memory_bytes "):
+            return float(line.split()[1])
+    return 0.0
+
+
+async def scenario_auth(client, args) -> list[dict]:
+    register, login, failures = [], [], []
+
+    async def job():
+        username = f"bench-{uuid.uuid4().hex[:12]}"
+        if await timed(lambda: client.post("/auth/register", json={"username": username, "password": PASSWORD}), register, failures):
+            await timed(lambda: client.post("/auth/login", data={"username": username, "password": PASSWORD}), login, failures)
+
+    elapsed = await run_concurrently([job] * args.users, args.concurrency)
+    return [summary("register", register, elapsed, len(failures)), summary("login", login, elapsed)]
+
+
+async def scenario_crud(client, args) -> list[dict]:
+    users = [await new_user(client) for _ in range(args.concurrency)]
+    results = {name: [] for name in ("create", "get", "patch", "delete")}
+    failures = []
+
+    async def job(headers):
+        for i in range(args.ops):
+            response = await timed(
+                lambda: client.post("/notes", json={"title": f"bench {i}", "content": "x" * 500}, headers=headers),
+                results["create"],
+                failures,
+            )
+            if response is None:
+                continue
+            note_id = response.json()["id"]
+            await timed(lambda: client.get(f"/notes/{note_id}", headers=headers), results["get"], failures)
+            await timed(
+                lambda: client.patch(f"/notes/{note_id}", json={"content": "y" * 500}, headers=headers), results["patch"], failures
+            )
+            await timed(lambda: client.delete(f"/notes/{note_id}", headers=headers), results["delete"], failures)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(job(headers) for _, headers in users))
+    elapsed = time.perf_counter() - started
+    return [summary(f"note {name}", latencies, elapsed, len(failures) if name == "create" else 0) for name, latencies in results.items()]
+
+
+async def scenario_list(client, args) -> list[dict]:
+    _, headers = await new_user(client)
+    started = time.perf_counter()
+    for offset in range(0, args.notes, 500):
+        ops = [
+            {"op": "create", "data": {"title": f"note {i}", "content": "lorem ipsum " * 20, "tags": "bench"}}
+            for i in range(offset, min(offset + 500, args.notes))
+        ]
+        (await client.post("/notes/batch", json={"ops": ops}, headers=headers)).raise_for_status()
+    print(f"seeded {args.notes} notes in {time.perf_counter() - started:.1f}s")
+
+    pages, failures = [], []
+    started = time.perf_counter()
+    cursor = None
+    while True:
+        params = {"limit": args.page_size, **({"cursor": cursor} if cursor else {})}
+        response = await timed(lambda: client.get("/notes", params=params, headers=headers), pages, failures)
+        cursor = response.headers.get("X-Next-Cursor") if response is not None else None
+        if not cursor:
+            break
+    paged = time.perf_counter() - started
+
+    full = []
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        response = await timed(lambda: client.get("/notes", headers=headers), full, failures)
+    full_elapsed = time.perf_counter() - started
+
+    # what a polling client pays while nothing changes
+    revalidate = {**headers, "If-None-Match": response.headers.get("ETag", "") if response is not None else ""}
+    unchanged = []
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        await timed(lambda: client.get("/notes", headers=revalidate), unchanged, failures)
+    return [
+        summary(f"list page ({args.page_size})", pages, paged, len(failures)),
+        summary(f"list all ({args.notes})", full, full_elapsed),
+        summary("list all, unchanged (304)", unchanged, time.perf_counter() - started),
+    ]
+
+
+async def open_sockets(urls: list[str], on_message, subscribe: list[dict] = ()) -> list:
+    sockets = []
+
+    async def open_one(url):
+        ws = await websockets.connect(url, max_size=None, open_timeout=30)
+        await ws.recv()  # init, or "ready" on /ws
+        for message in subscribe:
+            await ws.send(json.dumps(message))
+            await ws.recv()  # its init
+        sockets.append(ws)
+
+    # connect in waves so the accept backlog is not the thing being measured
+    for offset in range(0, len(urls), 200):
+        await asyncio.gather(*(open_one(url) for url in urls[offset : offset + 200]))
+    readers = [asyncio.create_task(read_messages(ws, on_message)) for ws in sockets]
+    return sockets, readers
+
+
+async def read_messages(ws, on_message) -> None:
+    try:
+        async for raw in ws:
+            message = json.loads(raw)
+            if message.get("type") == "ping":
+                await ws.send('{"type": "pong"}')
+                continue
+            on_message(message)
+    except websockets.ConnectionClosed:
+        pass
+
+
+async def close_sockets(sockets, readers) -> None:
+    for task in readers:
+        task.cancel()
+    await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+
+
+async def broadcast_scenario(client, args, name, urls, send, marker_of, subscribers_per_message, subscribe=()) -> list[dict]:
+    """Open urls, run args.messages sends, and time each until all its subscribers have it."""
+    sent_at: dict[str, float] = {}
+    received: dict[str, int] = {}
+    delivery: list[float] = []
+    done: dict[str, asyncio.Event] = {}
+
+    def on_message(message):
+        marker = marker_of(message)
+        if marker not in sent_at:
+            return
+        delivery.append(time.perf_counter() - sent_at[marker])
+        received[marker] = received.get(marker, 0) + 1
+        if received[marker] >= subscribers_per_message(marker):
+            done[marker].set()
+
+    memory_before = await server_memory(client)
+    started = time.perf_counter()
+    sockets, readers = await open_sockets(urls, on_message, subscribe)
+    connect_elapsed = time.perf_counter() - started
+    memory_per_connection = (await server_memory(client) - memory_before) / len(sockets)
+
+    requests, complete, failures = [], [], []
+    started = time.perf_counter()
+    for i in range(args.messages):
+        marker = f"bench-{i}-{uuid.uuid4().hex[:6]}"
+        done[marker] = asyncio.Event()
+        sent_at[marker] = time.perf_counter()
+        if await timed(lambda: send(i, marker), requests, failures) is None:
+            continue
+        try:
+            await asyncio.wait_for(done[marker].wait(), 30)
+            complete.append(time.perf_counter() - sent_at[marker])
+        except asyncio.TimeoutError:
+            failures.append(1)
+    elapsed = time.perf_counter() - started
+    await close_sockets(sockets, readers)
+
+    print(
+        f"{name}: {len(sockets)} sockets connected in {connect_elapsed:.1f}s, "
+        f"server memory {memory_per_connection / 1024:.1f} KiB per connection"
+    )
+    return [
+        summary(f"{name} request", requests, elapsed, len(failures)),
+        summary(f"{name} delivery (each)", delivery, elapsed),
+        summary(f"{name} delivery (all)", complete, elapsed),
+    ]
+
+
+async def scenario_ws_notes(client, args) -> list[dict]:
+    token, headers = await new_user(client)
+    note_ids = []
+    for i in range(args.channels):
+        response = await client.post("/notes", json={"title": f"ws {i}", "content": ""}, headers=headers)
+        note_ids.append(response.json()["id"])
+    base = args.url.replace("http", "ws", 1)
+    urls = [f"{base}/ws/notes/{note_ids[i % len(note_ids)]}?token={token}" for i in range(args.sockets)]
+    per_note = {note_id: urls.count(f"{base}/ws/notes/{note_id}?token={token}") for note_id in note_ids}
+    targets: dict[str, str] = {}
+
+    def send(i, marker):
+        note_id = note_ids[i % len(note_ids)]
+        targets[marker] = note_id
+        return client.patch(f"/notes/{note_id}", json={"content": marker}, headers=headers)
+
+    def marker_of(message):
+        return message.get("content") if message.get("type") == "note_updated" else None
+
+    return await broadcast_scenario(client, args, "ws-notes", urls, send, marker_of, lambda marker: per_note[targets[marker]])
+
+
+async def scenario_ws_calendar(client, args) -> list[dict]:
+    token, headers = await new_user(client)
+    base = args.url.replace("http", "ws", 1)
+    urls = [f"{base}/ws/calendar?token={token}"] * args.sockets
+
+    def send(i, marker):
+        return client.post(
+            "/calendar",
+            json={"title": marker, "start_time": "2030-01-01T10:00:00", "end_time": "2030-01-01T11:00:00"},
+            headers=headers,
+        )
+
+    def marker_of(message):
+        if message.get("type") == "calendar" and message.get("action") == "created":
+            return message["event"]["title"]
+        return None
+
+    return await broadcast_scenario(client, args, "ws-calendar", urls, send, marker_of, lambda marker: args.sockets)
+
+
+async def scenario_ws_mux(client, args) -> list[dict]:
+    token, headers = await new_user(client)
+    note_ids = []
+    for i in range(args.channels):
+        response = await client.post("/notes", json={"title": f"mux {i}", "content": ""}, headers=headers)
+        note_ids.append(response.json()["id"])
+    base = args.url.replace("http", "ws", 1)
+    urls = [f"{base}/ws?token={token}"] * args.sockets
+    subscribe = [{"type": "subscribe", "note": note_id} for note_id in note_ids]
+    subscribe.append({"type": "subscribe", "calendar": True})
+
+    def send(i, marker):
+        if i % 2:
+            return client.post(
+                "/calendar",
+                json={"title": marker, "start_time": "2030-01-01T10:00:00", "end_time": "2030-01-01T11:00:00"},
+                headers=headers,
+            )
+        return client.patch(f"/notes/{note_ids[i // 2 % len(note_ids)]}", json={"content": marker}, headers=headers)
+
+    def marker_of(message):
+        if message.get("type") == "note_updated":
+            return message.get("content")
+        if message.get("type") == "calendar" and message.get("action") == "created":
+            return message["event"]["title"]
+        return None
+
+    return await broadcast_scenario(client, args, "ws-mux", urls, send, marker_of, lambda marker: args.sockets, subscribe)
+
+
+async def scenario_ws_idle(client, args) -> list[dict]:
+    """Note CRUD while --sockets idle sockets are open; more sockets than pooled connections must not stall REST."""
+    token, headers = await new_user(client)
+    response = await client.post("/notes", json={"title": "idle", "content": ""}, headers=headers)
+    base = args.url.replace("http", "ws", 1)
+    urls = [
+        f"{base}/ws/notes/{response.json()['id']}?token={token}" if i % 2 else f"{base}/ws/calendar?token={token}"
+        for i in range(args.sockets)
+    ]
+    sockets, readers = await open_sockets(urls, lambda message: None)
+    try:
+        rows = await scenario_crud(client, args)
+    finally:
+        await close_sockets(sockets, readers)
+    return [{**row, "name": f"{row['name']} ({len(sockets)} idle ws)"} for row in rows]
+
+
+SCENARIOS = {
+    "auth": scenario_auth,
+    "crud": scenario_crud,
+    "list": scenario_list,
+    "ws-notes": scenario_ws_notes,
+    "ws-calendar": scenario_ws_calendar,
+    "ws-mux": scenario_ws_mux,
+    "ws-idle": scenario_ws_idle,
+}
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        names = list(SCENARIOS) if args.scenario == "all" else args.scenario.split(",")
+        rows = []
+        for name in names:
+            rows.extend(await SCENARIOS[name](client, args))
+        report(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--scenario", default="all", help="all, or a comma-separated list of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=64)
+    parser.add_argument("--ops", type=int, default=20, help="note CRUD cycles per user")
+    parser.add_argument("--notes", type=int, default=10000, help="notes seeded for the list scenario")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5, help="unpaginated list fetches")
+    parser.add_argument("--sockets", type=int, default=500)
+    parser.add_argument("--channels", type=int, default=10, help="notes the ws-notes sockets are spread over; every ws-mux socket subscribes to all of them")
+    parser.add_argument("--messages", type=int, default=50, help="broadcasts per WebSocket scenario")
+    asyncio.run(main(parser.parse_args()))
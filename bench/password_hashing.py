@@ -0,0 +1,94 @@
+"""
+Login hashing benchmark: argon2 inline on the event loop vs app.auth.PasswordHasher.
+
+Simulates CONCURRENCY simultaneous logins (password verification only, no
+database) and reports throughput plus event-loop lag, measured by a ticker
+that expects to wake every 10 ms.
+
+    python -m bench.password_hashing --logins 32 --concurrency 16
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from passlib.hash import argon2
+
+from app.auth import PasswordHasher
+from app.config import settings
+
+TICK = 0.01
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def measure(verify, hashed: str, logins: int, concurrency: int) -> dict:
+    lags: list[float] = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            expected = time.perf_counter() + TICK
+            await asyncio.sleep(TICK)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def login():
+        async with semaphore:
+            started = time.perf_counter()
+            assert await verify("correct horse", hashed)
+            latencies.append(time.perf_counter() - started)
+
+    tick_task = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK * 2)
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await tick_task
+    return {
+        "logins/s": logins / elapsed,
+        "login p50 ms": statistics.median(latencies) * 1000,
+        "login p99 ms": percentile(latencies, 99) * 1000,
+        "loop lag p50 ms": percentile(lags, 50) * 1000,
+        "loop lag p99 ms": percentile(lags, 99) * 1000,
+        "loop lag max ms": max(lags, default=0.0) * 1000,
+    }
+
+
+async def main(args):
+    hasher = PasswordHasher(
+        workers=args.workers,
+        max_pending=args.logins,
+        time_cost=settings.argon2_time_cost,
+        memory_cost=settings.argon2_memory_cost,
+        parallelism=settings.argon2_parallelism,
+    )
+    hashed = await hasher.hash("correct horse")
+
+    async def inline_verify(password, hashed):
+        return argon2.verify(password, hashed)
+
+    results = {
+        "inline": await measure(inline_verify, hashed, args.logins, args.concurrency),
+        f"pool({args.workers})": await measure(hasher.verify, hashed, args.logins, args.concurrency),
+    }
+    keys = list(next(iter(results.values())))
+    print(f"{'':12}" + "".join(f"{k:>18}" for k in keys))
+    for name, row in results.items():
+        print(f"{name:12}" + "".join(f"{row[k]:>18.1f}" for k in keys))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=settings.password_hash_workers)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,95 @@
+"""
+Per-item cost of encoding a note list: FastAPI's response_model path
+(validate every row into NoteOut, dump it, stdlib json) vs app.serialization
+(row dicts encoded directly, with orjson and with the stdlib fallback).
+
+Works on in-memory Note instances, so no database is needed.
+
+    python -m bench.serialization --notes 10000
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from app import serialization
+from app.models import Note
+from app.schemas import NoteOut
+
+
+def make_notes(count: int) -> list[Note]:
+    owner_id = uuid.uuid4()
+    now = datetime.utcnow()
+    return [
+        Note(
+            id=uuid.uuid4(),
+            title=f"note {i}",
+            content="Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4,
+            color="#ffcc00" if i % 3 else None,
+            tags="work, ideas",
+            archived=False,
+            revision=i % 50,
+            owner_id=owner_id,
+            updated_at=now - timedelta(minutes=i),
+        )
+        for i in range(count)
+    ]
+
+
+async def response_model(notes: list[Note]) -> bytes:
+    content = await serialize_response(field=RESPONSE_FIELD, response_content=notes, is_coroutine=True)
+    return JSONResponse(content).body
+
+
+async def direct(notes: list[Note]) -> bytes:
+    return serialization.FastJSONResponse([serialization.note_dict(note) for note in notes]).body
+
+
+async def direct_stdlib(notes: list[Note]) -> bytes:
+    encoder, serialization.orjson = serialization.orjson, None
+    try:
+        return await direct(notes)
+    finally:
+        serialization.orjson = encoder
+
+
+RESPONSE_FIELD = create_model_field(name="Response_list_notes", type_=list[NoteOut], mode="serialization")
+
+
+async def main(args):
+    notes = make_notes(args.notes)
+    candidates = [("response_model", response_model)]
+    if serialization.orjson is not None:
+        candidates.append(("direct (orjson)", direct))
+    candidates.append(("direct (stdlib json)", direct_stdlib))
+
+    reference = json.loads(await response_model(notes))
+    print(f"{args.notes} notes, best and median of {args.repeat} runs")
+    print(f"{'':24}{'total ms':>12}{'median ms':>12}{'us/item':>10}{'KiB':>10}")
+    for name, encode in candidates:
+        body = await encode(notes)
+        assert json.loads(body) == reference, name
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            await encode(notes)
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        print(
+            f"{name:24}{best * 1000:>12.1f}{statistics.median(timings) * 1000:>12.1f}"
+            f"{best / args.notes * 1e6:>10.2f}{len(body) / 1024:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
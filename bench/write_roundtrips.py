@@ -0,0 +1,164 @@
+"""
+Database round trips per write request: the note and event create/update
+endpoints and /notes/batch, driven in-process through the ASGI app.
+
+Runs against DATABASE_URL, in a throwaway user that is deleted afterwards,
+and reports statements per request and latency for each kind of write,
+twice: through the endpoints as they are, and with the request session
+re-reading every note and event it wrote after commit, the refresh the
+endpoints used to do (commit+refresh column).
+
+    python -m bench.write_roundtrips --writes 500
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import delete, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.database import AsyncSessionLocal, engine, get_session, init_models
+from app.main import app
+from app.models import Base, CalendarEvent, Note, User
+
+statements = 0
+# ids written by the create benchmarks, edited by the update ones
+created: dict[str, list[str]] = {}
+
+
+class WriteTrackingSession(Session):
+    """Collects the notes and events each flush writes, in info["written"]."""
+
+
+@event.listens_for(WriteTrackingSession, "after_flush")
+def track_written(session, flush_context) -> None:
+    # new and dirty still list what this flush wrote
+    written = [obj for obj in (*session.new, *session.dirty) if isinstance(obj, (Note, CalendarEvent))]
+    session.info.setdefault("written", []).extend(written)
+
+
+class RefreshingSession(AsyncSession):
+    """The former write path: every note and event written is SELECTed again after commit."""
+
+    async def commit(self) -> None:
+        await super().commit()
+        for obj in dict.fromkeys(self.sync_session.info.pop("written", [])):
+            await self.refresh(obj)
+
+
+RefreshingSessionLocal = sessionmaker(
+    bind=engine,
+    class_=RefreshingSession,
+    sync_session_class=WriteTrackingSession,
+    expire_on_commit=False,
+    autoflush=False,
+    autocommit=False,
+)
+
+
+async def refreshing_session():
+    async with RefreshingSessionLocal() as session:
+        yield session
+
+
+def count_statement(*args) -> None:
+    global statements
+    statements += 1
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def create_note(client, headers, i):
+    return client.post("/notes", json={"title": f"note {i}", "content": "x" * 200, "tags": "bench, write"}, headers=headers)
+
+
+def update_note(client, headers, i):
+    note_id = created["create_note"][i % len(created["create_note"])]
+    return client.patch(f"/notes/{note_id}", json={"content": f"edited {i}"}, headers=headers)
+
+
+def batch_update_notes(client, headers, i):
+    ids = created["create_note"][i * 20 % len(created["create_note"]) :][:20]
+    ops = [{"op": "update", "id": note_id, "data": {"content": f"batch {i}"}} for note_id in ids]
+    return client.post("/notes/batch", json={"ops": ops}, headers=headers)
+
+
+def create_event(client, headers, i):
+    start = datetime.utcnow() + timedelta(days=1, minutes=i)
+    payload = {"title": f"event {i}", "start_time": start.isoformat(), "end_time": (start + timedelta(hours=1)).isoformat()}
+    return client.post("/calendar", json=payload, headers=headers)
+
+
+def update_event(client, headers, i):
+    event_id = created["create_event"][i % len(created["create_event"])]
+    return client.patch(f"/calendar/{event_id}", json={"title": f"event {i} (edited)"}, headers=headers)
+
+
+async def run(write, client, headers, writes: int) -> dict:
+    latencies = []
+    counts = []
+    ids = []
+    for i in range(writes):
+        before = statements
+        started = time.perf_counter()
+        response = await write(client, headers, i)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        counts.append(statements - before)
+        if isinstance(response.json(), dict):
+            ids.append(response.json()["id"])
+    created[write.__name__] = ids
+    return {
+        "statements/request": statistics.mean(counts),
+        "p50 ms": statistics.median(latencies) * 1000,
+        "p99 ms": percentile(latencies, 99) * 1000,
+        "requests/s": writes / sum(latencies),
+    }
+
+
+async def main(args):
+    await init_models(Base.metadata)
+    username = f"bench-{uuid.uuid4().hex[:12]}"
+    modes = {"commit+refresh": refreshing_session, "current": None}
+    results: dict[str, dict[str, dict]] = {mode: {} for mode in modes}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        (await client.post("/auth/register", json={"username": username, "password": "bench-password"})).raise_for_status()
+        response = await client.post("/auth/login", data={"username": username, "password": "bench-password"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        event.listen(engine.sync_engine, "before_cursor_execute", count_statement)
+        try:
+            for mode, session_dependency in modes.items():
+                if session_dependency is not None:
+                    app.dependency_overrides[get_session] = session_dependency
+                try:
+                    for write in (create_note, update_note, batch_update_notes, create_event, update_event):
+                        results[mode][write.__name__] = await run(write, client, headers, args.writes)
+                finally:
+                    app.dependency_overrides.pop(get_session, None)
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", count_statement)
+            async with AsyncSessionLocal() as session:
+                await session.execute(delete(User).where(User.username == username))
+                await session.commit()
+            await engine.dispose()
+
+    keys = list(next(iter(results["current"].values())))
+    print(f"{'':22}" + "".join(f"{k:>32}" for k in keys))
+    print(f"{'':22}" + "".join(f"{mode:>16}" for _ in keys for mode in modes))
+    for name in results["current"]:
+        print(f"{name:22}" + "".join(f"{results[mode][name][k]:>16.2f}" for k in keys for mode in modes))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writes", type=int, default=500)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,87 @@
+"""
+Stand-ins for the database: StubSession plays the few session calls the
+WebSocket handlers and app.collab make, against one stored note.
+"""
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Optional
+
+import pytest
+
+from app import collab, main
+from app.collab import documents
+from app.models import Note
+
+
+class StubStore:
+    def __init__(self, note: Note, owner):
+        self.note = note  # the stored row
+        self.owner = owner
+        self.writes: list[dict] = []  # committed UPDATE notes parameters
+        self.failing_commits = 0
+        self.pool_size: Optional[int] = None  # sessions that may be open at once, None = unlimited
+        self.checked_out = 0
+
+
+class StubSession:
+    def __init__(self, store: StubStore):
+        self.store = store
+        self.pending: list[dict] = []
+
+    async def __aenter__(self):
+        if self.store.pool_size is not None and self.store.checked_out >= self.store.pool_size:
+            raise TimeoutError("connection pool exhausted")
+        self.store.checked_out += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.store.checked_out -= 1
+
+    async def get(self, model, key, **options):
+        return self.store.note if key == self.store.note.id else None
+
+    async def execute(self, stmt):
+        if getattr(stmt, "is_update", False) and stmt.table.name == "notes":
+            params = stmt.compile().params
+            if params.get("revision_1", self.store.note.revision) != self.store.note.revision:
+                return SimpleNamespace(scalar_one_or_none=lambda: None)  # lost the compare-and-set
+            self.pending.append(params)
+        return SimpleNamespace(scalar_one_or_none=lambda: self.store.note.owner_id, scalars=lambda: [])
+
+    async def flush(self):
+        pass
+
+    async def commit(self):
+        if self.store.failing_commits:
+            self.store.failing_commits -= 1
+            raise ConnectionError("database went away")
+        for params in self.pending:
+            for field in ("title", "content", "revision", "updated_at"):
+                setattr(self.store.note, field, params[field])
+        self.store.writes.extend(self.pending)
+        self.pending = []
+
+    async def rollback(self):
+        self.pending = []
+
+
+@pytest.fixture
+def store(monkeypatch):
+    owner = SimpleNamespace(id=uuid.uuid4())
+    note = Note(
+        id=uuid.uuid4(), title="t", content="hello", tags="", archived=False, revision=0, owner_id=owner.id, updated_at=datetime.utcnow()
+    )
+    store = StubStore(note, owner)
+
+    async def authenticate_token(token, session):
+        return owner
+
+    monkeypatch.setattr(main, "AsyncSessionLocal", lambda: StubSession(store))
+    monkeypatch.setattr(main, "ReadSessionLocal", lambda: StubSession(store))
+    monkeypatch.setattr(collab, "AsyncSessionLocal", lambda: StubSession(store))
+    monkeypatch.setattr(main, "authenticate_token", authenticate_token)
+    monkeypatch.setattr(main.app.router, "on_startup", [])
+    monkeypatch.setattr(documents, "flush_interval", 3600)
+    yield store
+    assert documents.get(note.id) is None
@@ -0,0 +1,107 @@
+"""
+Write-behind of live note edits (app.collab.DocumentRegistry), driven
+through the /ws patch flow. Sessions are stubbed (see conftest.py), so no
+database is needed.
+"""
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.collab import DocumentRegistry, documents
+from app.models import Note
+
+
+def wait_for(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def edit(ws, note: Note, rev: int, ops: list) -> dict:
+    ws.send_json({"type": "patch", "note": str(note.id), "rev": rev, "ops": ops})
+    return ws.receive_json()
+
+
+def open_note(client: TestClient, note: Note):
+    ws = client.websocket_connect("/ws?token=t")
+    ws.__enter__()
+    assert ws.receive_json()["type"] == "ready"
+    ws.send_json({"type": "subscribe", "note": str(note.id)})
+    assert ws.receive_json()["type"] == "init"
+    return ws
+
+
+def test_flush_on_disconnect(store):
+    with TestClient(main.app) as client:
+        ws = open_note(client, store.note)
+        assert edit(ws, store.note, 0, [5, " world"])["rev"] == 1
+        assert edit(ws, store.note, 1, [11, "!"])["rev"] == 2
+        assert store.writes == []  # within flush_interval, nothing written yet
+        ws.__exit__(None, None, None)
+        assert wait_for(lambda: store.writes)
+    assert [(w["content"], w["revision"]) for w in store.writes] == [("hello world!", 2)]
+
+
+def test_flush_all(store):
+    with TestClient(main.app) as client:
+        ws = open_note(client, store.note)
+        edit(ws, store.note, 0, [5, " world"])
+        client.portal.call(documents.flush_all)
+        assert [w["content"] for w in store.writes] == ["hello world"]
+        edit(ws, store.note, 1, [11, "!"])
+        ws.__exit__(None, None, None)
+        assert wait_for(lambda: len(store.writes) == 2)
+    assert store.writes[-1]["content"] == "hello world!"
+
+
+def test_failed_flush_is_retried(store, monkeypatch):
+    monkeypatch.setattr(documents, "flush_interval", 0.05)
+    store.failing_commits = 1
+    failures = documents.flush_failures
+    with TestClient(main.app) as client:
+        ws = open_note(client, store.note)
+        edit(ws, store.note, 0, [5, " world"])
+        assert wait_for(lambda: store.writes)
+        assert documents.flush_failures == failures + 1
+        ws.__exit__(None, None, None)
+        assert wait_for(lambda: documents.get(store.note.id) is None)
+    assert [w["content"] for w in store.writes] == ["hello world"]
+
+
+def test_concurrent_documents_merge(store):
+    # two workers with a live document each, and a REST write from a third
+    workers = [DocumentRegistry(history_size=50, flush_interval=3600, flush_max_revisions=1000) for _ in range(2)]
+    a, b = (worker.open(store.note) for worker in workers)
+    a.apply(0, [5, " world"])
+    b.apply(0, ["well, ", 5])
+
+    async def flush():
+        await workers[0].flush(a)
+        await workers[1].flush(b)
+
+    asyncio.run(flush())
+    assert (store.note.content, store.note.revision) == ("well, hello world", 2)
+    assert workers[1].merges == 1 and not b.dirty
+
+    a.apply(1, [11, "!"])
+    store.note.content, store.note.revision = "well, Hello world", 3
+    asyncio.run(workers[0].flush(a))
+    assert a.content == store.note.content == "well, Hello world!"
+    # an edit made before the merge is rebased over it
+    assert a.apply(1, ["> ", 11]) == ["> ", 18]
+    assert a.content == "> well, Hello world!"
+
+
+def test_flush_stamps_write_time(store):
+    # a /sync token issued between the edit and its write must still see it
+    registry = DocumentRegistry(history_size=50, flush_interval=3600, flush_max_revisions=1000)
+    doc = registry.open(store.note)
+    doc.apply(0, [5, "!"])
+    edited = doc.updated_at
+    time.sleep(0.01)
+    asyncio.run(registry.flush(doc))
+    assert store.writes[-1]["updated_at"] > edited
+    assert doc.updated_at == store.note.updated_at
@@ -0,0 +1,47 @@
+"""
+app.ot against the JavaScript client's view of the text: lengths and
+offsets count UTF-16 code units.
+"""
+import pytest
+
+from app import ot
+from app.collab import NoteDocument
+from app.models import Note
+
+EMOJI = "\N{GRINNING FACE}"  # outside the BMP: two UTF-16 code units, one code point
+
+
+def test_lengths_count_utf16_code_units():
+    assert ot.length(EMOJI) == 2
+    assert ot.target_length([3, EMOJI, -1]) == 5
+
+
+def test_offsets_after_astral_character():
+    text = f"{EMOJI} hello world"  # "hello" starts at JS offset 3
+    assert ot.apply(text, [9, "!", 5]) == f"{EMOJI} hello !world"
+    assert ot.apply(text, [3, -6, 5]) == f"{EMOJI} world"
+    with pytest.raises(ValueError):
+        ot.apply(text, [8, "!", 5])  # the code point length: one short
+
+
+def test_split_surrogate_pair_is_rejected():
+    with pytest.raises(ValueError):
+        ot.apply(EMOJI, [1, "x", 1])
+
+
+def test_replace_and_transform():
+    old, new = f"a{EMOJI}b", f"a{EMOJI}{EMOJI}b"
+    ops = ot.replace(old, new)
+    assert ops == [3, EMOJI, 1]
+    assert ot.apply(old, ops) == new
+    a, b = ot.transform([EMOJI, 4], [4, "c"])
+    assert a == [EMOJI, 5] and b == [6, "c"]
+
+
+def test_patch_after_emoji_applies_to_live_document():
+    note = Note(title="t", content=f"{EMOJI} hello", revision=0)
+    doc = NoteDocument(note, history_size=10)
+    doc.apply(0, [2, "!", 6])
+    # a concurrent edit at JS offset 9, made without the one above
+    assert doc.apply(0, [8, " world"]) == [9, " world"]
+    assert doc.content == f"{EMOJI}! hello world"
@@ -0,0 +1,78 @@
+"""
+Cross-worker fan-out of RedisBroadcaster: two broadcasters, standing in for
+two worker processes, share one fakeredis server.
+"""
+import asyncio
+
+import pytest
+
+from app import cache
+from app.realtime import RedisBroadcaster
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class StubWebSocket:
+    def __init__(self):
+        self.received: list[str] = []
+
+    async def send_text(self, message: str) -> None:
+        self.received.append(message)
+
+
+async def settle() -> None:
+    """Let the pub/sub listeners and connection writers run."""
+    await asyncio.sleep(0.2)
+
+
+def run_workers(monkeypatch, scenario) -> None:
+    async def main():
+        monkeypatch.setattr(cache, "_redis", fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer(), decode_responses=True))
+        workers = [RedisBroadcaster("test:ws:", queue_size=64, send_timeout=5.0) for _ in range(2)]
+        for worker in workers:
+            await worker.start()
+        try:
+            await scenario(*workers)
+        finally:
+            for worker in workers:
+                await worker.stop()
+
+    asyncio.run(main())
+
+
+def test_publish_reaches_subscribers_on_every_worker(monkeypatch):
+    a_sock, b_sock, other = StubWebSocket(), StubWebSocket(), StubWebSocket()
+
+    async def scenario(a, b):
+        await a.subscribe("note:1", a_sock)
+        await b.subscribe("note:1", b_sock)
+        await b.subscribe("note:2", other)
+        await settle()
+        await a.publish("note:1", "from a")
+        await b.publish("note:1", "from b")
+        await settle()
+
+    run_workers(monkeypatch, scenario)
+    # the publisher's own sockets get the message through Redis too, in the same order
+    assert a_sock.received == ["from a", "from b"]
+    assert b_sock.received == ["from a", "from b"]
+    assert other.received == []
+
+
+def test_unsubscribe_stops_delivery(monkeypatch):
+    a_sock, b_sock = StubWebSocket(), StubWebSocket()
+
+    async def scenario(a, b):
+        await a.subscribe("note:1", a_sock)
+        await b.subscribe("note:1", b_sock)
+        await settle()
+        await a.publish("note:1", "first")
+        await settle()
+        await b.unsubscribe("note:1", b_sock)
+        assert b.stats()["channels"] == 0
+        await a.publish("note:1", "second")
+        await settle()
+
+    run_workers(monkeypatch, scenario)
+    assert a_sock.received == ["first", "second"]
+    assert b_sock.received == ["first"]
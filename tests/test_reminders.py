@@ -0,0 +1,22 @@
+"""
+Reminder fire times: event times are wall-clock times in the owner's zone,
+fire times are UTC.
+"""
+import uuid
+from datetime import date, datetime
+
+from app.models import CalendarEvent
+from app.reminders import event_start, local_to_utc
+
+
+def test_local_to_utc_follows_dst():
+    assert local_to_utc(datetime(2026, 1, 15, 9, 0), "Europe/Warsaw") == datetime(2026, 1, 15, 8, 0)
+    assert local_to_utc(datetime(2026, 7, 15, 9, 0), "Europe/Warsaw") == datetime(2026, 7, 15, 7, 0)
+    assert local_to_utc(datetime(2026, 7, 15, 9, 0), "UTC") == datetime(2026, 7, 15, 9, 0)
+
+
+def test_all_day_events_start_at_the_local_reminder_hour():
+    event = CalendarEvent(owner_id=uuid.uuid4(), is_all_day=True, event_date=date(2026, 3, 30))
+    start = event_start(event)
+    assert start == datetime(2026, 3, 30, 9, 0)
+    assert local_to_utc(start, "Europe/Warsaw") == datetime(2026, 3, 30, 7, 0)  # the day after the switch to CEST
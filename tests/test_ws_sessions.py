@@ -0,0 +1,53 @@
+"""
+WebSocket handlers hold a database session only for their handshake, so
+far more sockets than pooled connections can stay open while REST requests
+still get a connection. The pool is a StubSession limit of one (see
+conftest.py).
+"""
+import time
+from contextlib import ExitStack
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.auth import get_current_user
+from app.collab import documents
+from app.database import get_read_session
+from conftest import StubSession
+
+
+def test_idle_sockets_do_not_hold_sessions(store, monkeypatch):
+    async def read_session():
+        async with StubSession(store) as session:
+            yield session
+
+    monkeypatch.setitem(main.app.dependency_overrides, get_current_user, lambda: store.owner)
+    monkeypatch.setitem(main.app.dependency_overrides, get_read_session, read_session)
+    store.pool_size = 1
+    note_id = str(store.note.id)
+
+    with TestClient(main.app) as client, ExitStack() as sockets:
+        for i in range(12):
+            kind = i % 3
+            if kind == 0:
+                ws = sockets.enter_context(client.websocket_connect(f"/ws/notes/{note_id}?token=t"))
+                assert ws.receive_json()["type"] == "init"
+            elif kind == 1:
+                ws = sockets.enter_context(client.websocket_connect("/ws/calendar?token=t"))
+                assert ws.receive_json()["type"] == "init"
+            else:
+                ws = sockets.enter_context(client.websocket_connect("/ws?token=t"))
+                assert ws.receive_json()["type"] == "ready"
+                ws.send_json({"type": "subscribe", "note": note_id})
+                assert ws.receive_json()["type"] == "init"
+        assert store.checked_out == 0
+
+        response = client.get(f"/notes/{note_id}")
+        assert response.status_code == 200
+        assert response.json()["content"] == "hello"
+        assert store.checked_out == 0
+
+        sockets.close()
+        deadline = time.monotonic() + 2.0
+        while documents.get(store.note.id) is not None and time.monotonic() < deadline:
+            time.sleep(0.01)